@@ -7,39 +7,65 @@ Modifie les images du champ "Question" d'un deck Anki (.apkg).
 Operations disponibles:
 - Crop depuis un bord (droite, gauche, haut, bas)
 - Masquer un coin (remplir de blanc/noir)
+- Automatique : bordures uniformes et incrustations (logos, texte) détectées
 
 INSTALLATION:
-    pip install Pillow pillow-avif-plugin
+    pip install Pillow pillow-avif-plugin numpy
 
 UTILISATION:
     python anki_image_cropper.py
+    python anki_image_cropper.py --batch decks/ --op crop:droite:35
 """
 
 import sys
 import os
+import argparse
 import re
 import json
 import sqlite3
 import zipfile
 import tempfile
 import shutil
+import glob
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
-# Vérifier si Pillow est installé
-try:
-    from PIL import Image
-    PILLOW_AVAILABLE = True
-except ImportError:
-    PILLOW_AVAILABLE = False
-    print("⚠️  Pillow non installé. Installez-le avec: pip install Pillow")
+from anki_verifier import verify_apkg, print_report
+from anki_zip import ParallelZipWriter
 
-# Support AVIF
-try:
-    import pillow_avif
-    AVIF_AVAILABLE = True
-except ImportError:
-    AVIF_AVAILABLE = False
-    print("⚠️  Support AVIF non disponible. Installez: pip install pillow-avif-plugin")
+__all__ = ['transform_apkg', 'transform_many', 'crop_image', 'mask_corner']
+
+
+@lru_cache(maxsize=None)
+def _pil_image():
+    """Charge Pillow (et le support AVIF) à la première utilisation."""
+    try:
+        from PIL import Image
+    except ImportError:
+        print("⚠️  Pillow non installé. Installez-le avec: pip install Pillow")
+        return None
+
+    # Support AVIF
+    try:
+        import pillow_avif
+    except ImportError:
+        print("⚠️  Support AVIF non disponible. Installez: pip install pillow-avif-plugin")
+
+    return Image
+
+
+@lru_cache(maxsize=None)
+def _numpy():
+    """Charge numpy à la première utilisation (None s'il n'est pas installé)."""
+    try:
+        import numpy
+    except ImportError:
+        print("⚠️  numpy non installé. Installez-le avec: pip install numpy")
+        return None
+    return numpy
 
 
 def extract_apkg(apkg_path, extract_dir):
@@ -73,6 +99,7 @@ def get_question_images(db_path):
 
 def crop_image(image_path, direction, percent):
     """Coupe une image depuis un bord selon le pourcentage donné."""
+    Image = _pil_image()
     try:
         with Image.open(image_path) as img:
             if img.mode in ('RGBA', 'P'):
@@ -122,6 +149,7 @@ def crop_image(image_path, direction, percent):
 
 def mask_corner(image_path, corner, width_percent, height_percent, color='white'):
     """Masque un coin de l'image avec une couleur."""
+    Image = _pil_image()
     try:
         with Image.open(image_path) as img:
             # Convertir en RGBA pour supporter la transparence si nécessaire
@@ -155,9 +183,7 @@ def mask_corner(image_path, corner, width_percent, height_percent, color='white'
                 return False
 
             # Remplir la zone avec la couleur
-            for x in range(x1, x2):
-                for y in range(y1, y2):
-                    result.putpixel((x, y), fill_color)
+            result.paste(fill_color, (x1, y1, x2, y2))
 
             # Convertir en RGB pour sauvegarder en PNG
             result = result.convert('RGB')
@@ -168,29 +194,461 @@ def mask_corner(image_path, corner, width_percent, height_percent, color='white'
         return False
 
 
-def create_apkg(source_dir, output_path, media_map):
-    """Recrée un fichier .apkg à partir des fichiers extraits."""
-    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+CROP_DIRECTIONS = ('droite', 'gauche', 'haut', 'bas')
+MASK_CORNERS = ('bas-droite', 'bas-gauche', 'haut-droite', 'haut-gauche')
+
+# Réglages de la détection automatique
+BORDER_TOLERANCE = 16      # écart max (0-255) d'un pixel avec la couleur du bord
+BORDER_NOISE = 0.02        # part de pixels différents tolérée sur une ligne de bord
+BORDER_EDGE = 0.5          # part de la ligne qui suit une bande devant en différer (bord net)
+BORDER_MAX = 0.2           # bande retirée au plus par côté (fraction de l'image)
+OVERLAY_CORNER = 0.3       # taille des coins examinés (fraction de l'image)
+OVERLAY_WINDOW = 0.05      # côté de la fenêtre glissante (fraction du petit côté)
+OVERLAY_EDGE = 80          # contraste minimal (0-255) d'un bord de texte ou de logo
+OVERLAY_RATIO = 4.0        # densité de contours de la fenêtre / densité au centre
+OVERLAY_MIN_DENSITY = 0.08
+
+
+def detect_borders(pixels, tolerance=BORDER_TOLERANCE, noise=BORDER_NOISE, edge=BORDER_EDGE,
+                   max_fraction=BORDER_MAX):
+    """
+    Détecte les bandes uniformes sur les quatre bords d'une image (tableau
+    numpy H x W x 3). Retourne la boîte (gauche, haut, droite, bas) du contenu.
+
+    Une bande n'est retenue que si elle s'arrête net (la ligne suivante
+    diffère de sa couleur sur au moins edge de sa largeur) et ne dépasse pas
+    max_fraction de l'image : un ciel uni ou un sol uniforme, qui se fondent
+    progressivement dans la photo, sont du contenu. La détection est relancée
+    dans la boîte obtenue tant qu'elle trouve des bandes, pour les bordures de
+    couleurs différentes sur deux côtés adjacents.
+    """
+    np = _numpy()
+    height, width = pixels.shape[:2]
+
+    def band(edge_pixels, limit):
+        # edge_pixels : image tournée pour que le bord examiné soit la ligne 0.
+        # Les lignes sont examinées par blocs de taille croissante : une image
+        # sans bordure ne coûte que quelques lignes.
+        if limit <= 0:
+            return 0
+        color = np.median(edge_pixels[0], axis=0)
+        start, step = 0, 8
+        while start < limit:
+            block = edge_pixels[start:min(limit + 1, start + step)].astype(np.int16)
+            differs = (np.abs(block - color).max(axis=2) > tolerance).mean(axis=1)
+            rows = np.flatnonzero(differs > noise)
+            if rows.size:
+                size = start + int(rows[0])
+                # Pas de bande, ou bande qui se fond dans le contenu
+                if size == 0 or differs[rows[0]] < edge:
+                    return 0
+                return size
+            start += step
+            step *= 2
+        return 0
+
+    left, top, right, bottom = 0, 0, width, height
+    max_rows, max_cols = int(height * max_fraction), int(width * max_fraction)
+    while bottom - top >= 2 and right - left >= 2:
+        box = pixels[top:bottom, left:right]
+        columns = box.transpose(1, 0, 2)
+        found = (band(box, max_rows - top), band(box[::-1], max_rows - (height - bottom)),
+                 band(columns, max_cols - left), band(columns[::-1], max_cols - (width - right)))
+        if not any(found):
+            break
+        top += found[0]
+        bottom -= found[1]
+        left += found[2]
+        right -= found[3]
+    return left, top, right, bottom
+
+
+def _grow(seeds, allowed):
+    """Étend une grille booléenne à ses voisines (8-connexité) dans allowed, jusqu'à stabilité."""
+    np = _numpy()
+    region = seeds & allowed
+    while True:
+        padded = np.pad(region, 1)
+        grown = padded[1:-1, 1:-1].copy()
+        for dy in (0, 1, 2):
+            for dx in (0, 1, 2):
+                grown |= padded[dy:dy + region.shape[0], dx:dx + region.shape[1]]
+        grown &= allowed
+        if (grown == region).all():
+            return region
+        region = grown
+
+
+def detect_overlays(pixels, edge=OVERLAY_EDGE, ratio=OVERLAY_RATIO, min_density=OVERLAY_MIN_DENSITY):
+    """
+    Détecte les incrustations très contrastées (logos, texte, filigranes)
+    dans les coins d'une image. La densité de contours forts est mesurée sur
+    une petite fenêtre glissante (un texte de 12 pixels de haut ne couvre
+    qu'une infime partie du coin) ; une incrustation part d'une fenêtre du
+    coin nettement plus dense que le centre de l'image et s'étend aux
+    fenêtres denses voisines dans le quart d'image. Retourne la liste des
+    boîtes (x1, y1, x2, y2) à masquer, une au plus par coin.
+    """
+    np = _numpy()
+    height, width = pixels.shape[:2]
+    pixels = pixels.astype(np.uint16)
+    luma = ((pixels[..., 0] * 77 + pixels[..., 1] * 150 + pixels[..., 2] * 29) >> 8).astype(np.int16)
+    edges = np.zeros((height, width), dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(luma, axis=1)) > edge
+    edges[1:, :] |= np.abs(np.diff(luma, axis=0)) > edge
+
+    ch, cw = max(1, int(height * OVERLAY_CORNER)), max(1, int(width * OVERLAY_CORNER))
+    center = edges[height // 4:height - height // 4, width // 4:width - width // 4]
+    baseline = center.mean() if center.size else 0.0
+    threshold = max(min_density, baseline * ratio)
+
+    # Densité de toutes les fenêtres de la grille, par sommes cumulées
+    window = max(4, int(min(height, width) * OVERLAY_WINDOW))
+    stride = max(1, window // 2)
+    integral = np.zeros((height + 1, width + 1), dtype=np.int32)
+    integral[1:, 1:] = edges.cumsum(axis=0).cumsum(axis=1)
+    ys = np.arange(0, max(0, height - window) + 1, stride)
+    xs = np.arange(0, max(0, width - window) + 1, stride)
+    y1, x1 = ys[:, None], xs[None, :]
+    y2, x2 = np.minimum(y1 + window, height), np.minimum(x1 + window, width)
+    counts = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+    dense = counts / ((y2 - y1) * (x2 - x1)) >= threshold
+
+    boxes = []
+    for top, left in ((True, True), (True, False), (False, True), (False, False)):
+        rows = (ys + window <= ch) if top else (ys >= height - ch)
+        cols = (xs + window <= cw) if left else (xs >= width - cw)
+        half_rows = (ys + window <= height // 2) if top else (ys >= height - height // 2)
+        half_cols = (xs + window <= width // 2) if left else (xs >= width - width // 2)
+        region = _grow(dense & rows[:, None] & cols[None, :], dense & half_rows[:, None] & half_cols[None, :])
+        if not region.any():
+            continue
+        # Boîte des contours contenus dans les fenêtres retenues
+        mask = np.zeros((height, width), dtype=bool)
+        for i, j in zip(*np.nonzero(region)):
+            mask[ys[i]:ys[i] + window, xs[j]:xs[j] + window] = True
+        mask &= edges
+        found_rows = np.flatnonzero(mask.any(axis=1))
+        found_cols = np.flatnonzero(mask.any(axis=0))
+        pad = 2
+        boxes.append((
+            max(0, int(found_cols[0]) - pad), max(0, int(found_rows[0]) - pad),
+            min(width, int(found_cols[-1]) + 1 + pad), min(height, int(found_rows[-1]) + 1 + pad),
+        ))
+    return boxes
+
+
+def auto_clean_image(image_path, color='white'):
+    """
+    Mode automatique : retire les bordures uniformes puis masque les
+    incrustations détectées dans les coins. Retourne False si l'image n'a
+    pas pu être traitée.
+    """
+    Image = _pil_image()
+    np = _numpy()
+    if np is None:
+        return False
+    try:
+        with Image.open(image_path) as img:
+            img = img.convert('RGB')
+            pixels = np.asarray(img)
+
+            left, top, right, bottom = detect_borders(pixels)
+            if right - left < 2 or bottom - top < 2:
+                # Image uniforme : rien à recadrer
+                left, top, right, bottom = 0, 0, img.width, img.height
+            pixels = pixels[top:bottom, left:right]
+            result = img.crop((left, top, right, bottom))
+
+            fill_color = (255, 255, 255) if color == 'white' else (0, 0, 0)
+            for box in detect_overlays(pixels):
+                result.paste(fill_color, box)
+
+            result.save(image_path, 'PNG')
+            return True
+    except Exception as e:
+        print(f"  ⚠️ Erreur: {e}")
+        return False
+
+
+def create_apkg(source_dir, output_path, media_map, compression_levels=None):
+    """Recrée un fichier .apkg à partir des fichiers extraits (compression en parallèle)."""
+    with ParallelZipWriter(output_path, compression_levels) as zf:
         db_path = os.path.join(source_dir, 'collection.anki2')
         if os.path.exists(db_path):
-            zf.write(db_path, 'collection.anki2')
+            zf.write(db_path, 'collection.anki2', 'collection')
 
         media_path = os.path.join(source_dir, 'media')
         if os.path.exists(media_path):
-            zf.write(media_path, 'media')
+            zf.write(media_path, 'media', 'media')
 
         for idx in media_map.keys():
             media_file = os.path.join(source_dir, idx)
             if os.path.exists(media_file):
-                zf.write(media_file, idx)
+                zf.write(media_file, idx, 'image')
+
+
+def apply_operation(image_path, operation):
+    """Applique une opération ('crop', ...) ou ('mask', ...) à une image."""
+    if operation[0] == 'crop':
+        return crop_image(image_path, operation[1], operation[2])
+    if operation[0] == 'mask':
+        return mask_corner(image_path, operation[1], operation[2], operation[3], operation[4])
+    if operation[0] == 'auto':
+        return auto_clean_image(image_path, operation[1] if len(operation) > 1 else 'white')
+    return False
+
+
+def apply_operations(image_path, ops):
+    """Applique une liste d'opérations à une image (tâche des workers du mode batch)."""
+    return all(apply_operation(image_path, op) for op in ops)
+
+
+def parse_operation(spec):
+    """
+    Convertit une spécification texte en liste d'opérations, par exemple
+    "crop:droite:35", "mask:bas-droite:40:50:white", "auto:black" ou
+    plusieurs opérations enchaînées : "crop:droite:35+auto".
+    """
+    ops = []
+    for part in spec.split('+'):
+        name, *args = part.strip().split(':')
+        if name == 'crop' and len(args) == 2 and args[0] in CROP_DIRECTIONS:
+            ops.append(('crop', args[0], float(args[1])))
+        elif name == 'mask' and len(args) == 4 and args[0] in MASK_CORNERS:
+            ops.append(('mask', args[0], float(args[1]), float(args[2]), args[3]))
+        elif name == 'auto' and len(args) <= 1:
+            ops.append(('auto', args[0] if args else 'white'))
+        else:
+            raise ValueError(f"Opération invalide: {part}")
+    return ops
+
+
+def _output_path(apkg_path, ops):
+    base_name = os.path.splitext(apkg_path)[0]
+    if any(op[0] == 'crop' for op in ops):
+        return f"{base_name}_cropped.apkg"
+    if any(op[0] == 'mask' for op in ops):
+        return f"{base_name}_masked.apkg"
+    return f"{base_name}_auto.apkg"
+
+
+def transform_apkg(apkg_path, ops, output_path=None, pool=None, verbose=True, on_image=None, verify=True):
+    """
+    API publique : applique une ou plusieurs opérations aux images du champ
+    Question d'un .apkg et écrit le résultat dans un nouveau fichier.
+
+    ops est une opération ('crop', direction, pourcentage),
+    ('mask', coin, largeur %, hauteur %, couleur) ou ('auto', couleur), ou
+    une liste d'opérations appliquées dans l'ordre. Avec pool (un
+    concurrent.futures.Executor), les images sont traitées par ce pool ;
+    on_image(succès) est appelé après chaque image. Retourne (chemin de
+    sortie, images traitées).
+
+    Avec verify, le paquet produit est contrôlé par anki_verifier.verify_apkg ;
+    s'il est incohérent (image manquante ou illisible, média orphelin...),
+    il est supprimé et ValueError est levée.
+    """
+    if ops and isinstance(ops[0], str):
+        ops = [ops]
+    log = print if verbose else (lambda *args, **kwargs: None)
+
+    if _pil_image() is None:
+        raise RuntimeError("Pillow est requis pour modifier les images")
+    if any(op[0] == 'auto' for op in ops) and _numpy() is None:
+        raise RuntimeError("numpy est requis pour le mode automatique")
+
+    with zipfile.ZipFile(apkg_path) as zf:
+        if 'meta' in zf.namelist():
+            raise ValueError("Paquet au format récent (zstd) non supporté : "
+                             "reconstruisez-le avec --format legacy")
+
+    # Créer un dossier temporaire
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        # Extraire le .apkg
+        log(f"\n📦 Extraction de {os.path.basename(apkg_path)}...")
+        extract_apkg(apkg_path, temp_dir)
+
+        # Lire le fichier media
+        media_json_path = os.path.join(temp_dir, 'media')
+        media_map = {}
+        if os.path.exists(media_json_path):
+            with open(media_json_path, 'r') as f:
+                media_map = json.load(f)
+
+        name_to_idx = {v: k for k, v in media_map.items()}
+
+        # Récupérer les images du champ Question
+        db_path = os.path.join(temp_dir, 'collection.anki2')
+        question_images = get_question_images(db_path)
+
+        log(f"\n🖼️  {len(question_images)} images trouvées dans le champ Question")
+
+        targets = []
+        for img_name in question_images:
+            img_path = os.path.join(temp_dir, name_to_idx[img_name]) if img_name in name_to_idx else None
+            if img_path and os.path.exists(img_path):
+                targets.append((img_name, img_path))
+            else:
+                log(f"  ⚠️ {img_name} absente du paquet")
+
+        # Appliquer les opérations
+        if pool is None:
+            results = ((img_name, apply_operations(img_path, ops)) for img_name, img_path in targets)
+        else:
+            futures = [(img_name, pool.submit(apply_operations, img_path, ops)) for img_name, img_path in targets]
+            results = ((img_name, future.result()) for img_name, future in futures)
+
+        processed_count = 0
+        for img_name, success in results:
+            log(f"  ✂️ {img_name} {'✓' if success else '✗'}")
+            if success:
+                processed_count += 1
+            if on_image:
+                on_image(success)
+
+        # Créer le nouveau fichier .apkg
+        if output_path is None:
+            output_path = _output_path(apkg_path, ops)
+
+        log(f"\n📦 Création de {os.path.basename(output_path)}...")
+        create_apkg(temp_dir, output_path, media_map)
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+    if verify:
+        report = verify_apkg(output_path)
+        if verbose:
+            print_report(report)
+        if not report['ok']:
+            # Comme le builder : un paquet incohérent n'est pas laissé sur le disque
+            os.remove(output_path)
+            problems = sum(len(report[key]) for key in ('errors', 'missing', 'corrupt', 'orphans'))
+            raise ValueError(f"Paquet produit incohérent, supprimé : {output_path} ({problems} problèmes, "
+                             f"voir python anki_verifier.py)")
+
+    return output_path, processed_count
+
+
+def find_packages(pattern):
+    """Liste les .apkg d'un dossier ou d'un motif glob, sans les sorties du cropper."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.apkg')
+    outputs = ('_cropped.apkg', '_masked.apkg', '_auto.apkg')
+    return sorted(path for path in glob.glob(pattern) if not path.endswith(outputs))
+
+
+def transform_many(paths, ops, workers=None, verify=True):
+    """
+    API publique : applique les mêmes opérations à plusieurs .apkg. Les
+    images de tous les paquets passent par un seul pool de processus ;
+    extraction et réécriture des paquets se font en parallèle dans des
+    threads. Chaque sortie est écrite à côté de son entrée. Retourne la
+    liste des (chemin d'entrée, chemin de sortie ou None, images traitées,
+    erreur ou None). verify : voir transform_apkg.
+    """
+    if ops and isinstance(ops[0], str):
+        ops = [ops]
+
+    lock = threading.Lock()
+    progress = {'packages': 0, 'images': 0, 'failed': 0}
+
+    def show():
+        print(f"\r  📦 {progress['packages']}/{len(paths)} paquets   "
+              f"🖼️  {progress['images']} images   ✗ {progress['failed']}", end='', flush=True)
+
+    def on_image(success):
+        with lock:
+            progress['images'] += 1
+            progress['failed'] += not success
+            show()
+
+    def run(path):
+        try:
+            output_path, processed = transform_apkg(path, ops, pool=image_pool, verbose=False, on_image=on_image,
+                                                 verify=verify)
+            result = (path, output_path, processed, None)
+        except Exception as e:
+            result = (path, None, 0, e)
+        with lock:
+            progress['packages'] += 1
+            show()
+        return result
+
+    with ProcessPoolExecutor(max_workers=workers) as image_pool, \
+            ThreadPoolExecutor(max_workers=min(len(paths), 4) or 1) as package_pool:
+        results = list(package_pool.map(run, paths))
+    print()
+    return results
 
 
-def main():
+def run_batch(pattern, spec, workers=None, verify=True):
+    """Mode batch non interactif : mêmes opérations sur tous les paquets trouvés."""
+    print("=" * 60)
+    print("  Anki Image Cropper (batch)")
+    print("=" * 60)
+
+    if _pil_image() is None:
+        print("\n❌ Pillow n'est pas installé!")
+        sys.exit(1)
+
+    try:
+        ops = parse_operation(spec or '')
+    except ValueError as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)
+
+    paths = find_packages(pattern)
+    if not paths:
+        print(f"\n❌ Aucun fichier .apkg trouvé: {pattern}")
+        sys.exit(1)
+
+    print(f"\n🗂️  {len(paths)} paquets, opérations: {spec}\n")
+    start = time.time()
+    results = transform_many(paths, ops, workers, verify)
+    elapsed = time.time() - start
+
+    print(f"\n{'-' * 60}")
+    failures = 0
+    for path, output_path, processed, error in results:
+        if error:
+            failures += 1
+            print(f"  ❌ {os.path.basename(path)}: {error}")
+        else:
+            print(f"  ✅ {os.path.basename(path)} → {os.path.basename(output_path)} ({processed} images)")
+    print(f"{'-' * 60}")
+    print(f"   📦 Paquets: {len(results) - failures}/{len(results)}")
+    print(f"   🖼️  Images traitées: {sum(r[2] for r in results)}")
+    print(f"   ⏱️  Durée: {elapsed:.1f} s")
+
+    if failures:
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Modifie les images du champ Question d'un deck Anki (.apkg).")
+    parser.add_argument('apkg', nargs='?', help="Fichier .apkg (demandé si absent)")
+    parser.add_argument('--batch', metavar='DOSSIER_OU_GLOB',
+                        help="Traiter tous les .apkg d'un dossier ou d'un motif (ex: 'decks/*.apkg')")
+    parser.add_argument('--op', metavar='SPEC',
+                        help="Opération du mode batch: crop:droite:35, mask:bas-droite:40:50:white, "
+                             "auto[:black], ou plusieurs reliées par +")
+    parser.add_argument('--workers', type=int, help="Nombre de processus pour les images (défaut: nb de cœurs)")
+    parser.add_argument('--no-verify', action='store_true',
+                        help="Ne pas vérifier les paquets produits (voir anki_verifier.py)")
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        return run_batch(args.batch, args.op, args.workers, not args.no_verify)
+
     print("=" * 60)
     print("  Anki Image Cropper")
     print("=" * 60)
 
-    if not PILLOW_AVAILABLE:
+    if _pil_image() is None:
         print("\n❌ Pillow n'est pas installé!")
         print("   pip install Pillow pillow-avif-plugin")
         input("\nAppuyez sur Entrée pour quitter...")
@@ -198,7 +656,7 @@ def main():
 
     # Demander le fichier .apkg
     print()
-    apkg_path = input("Chemin du fichier .apkg: ").strip().strip('"')
+    apkg_path = args.apkg or input("Chemin du fichier .apkg: ").strip().strip('"')
 
     if not apkg_path or not os.path.exists(apkg_path):
         print(f"\n❌ Fichier non trouvé: {apkg_path}")
@@ -210,9 +668,10 @@ def main():
     print("Operations disponibles:")
     print("  1. Crop depuis un bord")
     print("  2. Masquer un coin")
+    print("  3. Automatique (bordures et incrustations détectées)")
     print("-" * 40)
 
-    op_choice = input("Choix (1 ou 2): ").strip()
+    op_choice = input("Choix (1, 2 ou 3): ").strip()
 
     if op_choice == '1':
         # Crop depuis un bord
@@ -223,7 +682,7 @@ def main():
         print("  4. Bas")
 
         dir_choice = input("Choix (1-4, defaut: 1): ").strip() or '1'
-        directions = {'1': 'droite', '2': 'gauche', '3': 'haut', '4': 'bas'}
+        directions = dict(zip('1234', CROP_DIRECTIONS))
         direction = directions.get(dir_choice, 'droite')
 
         percent_input = input(f"Pourcentage a couper depuis {direction} (defaut: 35): ").strip()
@@ -248,7 +707,7 @@ def main():
         print("  4. Haut-gauche")
 
         corner_choice = input("Choix (1-4, defaut: 1): ").strip() or '1'
-        corners = {'1': 'bas-droite', '2': 'bas-gauche', '3': 'haut-droite', '4': 'haut-gauche'}
+        corners = dict(zip('1234', MASK_CORNERS))
         corner = corners.get(corner_choice, 'bas-droite')
 
         width_input = input("Largeur du masque en % (defaut: 40): ").strip()
@@ -280,71 +739,32 @@ def main():
         operation = ('mask', corner, width_percent, height_percent, color)
         print(f"\n🎭 Masque: {corner} ({width_percent}% x {height_percent}%) en {color}")
 
+    elif op_choice == '3':
+        # Détection automatique
+        print("\nCouleur des incrustations masquées:")
+        print("  1. Blanc")
+        print("  2. Noir")
+        color_choice = input("Choix (1 ou 2, defaut: 1): ").strip() or '1'
+        color = 'white' if color_choice == '1' else 'black'
+
+        operation = ('auto', color)
+        print(f"\n🔎 Automatique: bordures retirées, incrustations masquées en {color}")
+
     else:
         print("\n❌ Choix invalide.")
         input("\nAppuyez sur Entrée pour quitter...")
         sys.exit(1)
 
-    # Créer un dossier temporaire
-    temp_dir = tempfile.mkdtemp()
-
     try:
-        # Extraire le .apkg
-        print(f"\n📦 Extraction de {os.path.basename(apkg_path)}...")
-        extract_apkg(apkg_path, temp_dir)
-
-        # Lire le fichier media
-        media_json_path = os.path.join(temp_dir, 'media')
-        media_map = {}
-        if os.path.exists(media_json_path):
-            with open(media_json_path, 'r') as f:
-                media_map = json.load(f)
-
-        name_to_idx = {v: k for k, v in media_map.items()}
-
-        # Récupérer les images du champ Question
-        db_path = os.path.join(temp_dir, 'collection.anki2')
-        question_images = get_question_images(db_path)
-
-        print(f"\n🖼️  {len(question_images)} images trouvées dans le champ Question")
-
-        # Appliquer l'opération
-        processed_count = 0
-        for img_name in question_images:
-            if img_name in name_to_idx:
-                idx = name_to_idx[img_name]
-                img_path = os.path.join(temp_dir, idx)
-
-                if os.path.exists(img_path):
-                    print(f"  ✂️ {img_name}", end="")
-
-                    if operation[0] == 'crop':
-                        success = crop_image(img_path, operation[1], operation[2])
-                    else:  # mask
-                        success = mask_corner(img_path, operation[1], operation[2], operation[3], operation[4])
-
-                    if success:
-                        print(" ✓")
-                        processed_count += 1
-                    else:
-                        print(" ✗")
-
-        # Créer le nouveau fichier .apkg
-        base_name = os.path.splitext(apkg_path)[0]
-        if operation[0] == 'crop':
-            output_path = f"{base_name}_cropped.apkg"
-        else:
-            output_path = f"{base_name}_masked.apkg"
-
-        print(f"\n📦 Création de {os.path.basename(output_path)}...")
-        create_apkg(temp_dir, output_path, media_map)
-
-        print(f"\n✅ Terminé!")
-        print(f"   📁 Fichier: {output_path}")
-        print(f"   🖼️  Images traitées: {processed_count}")
+        output_path, processed_count = transform_apkg(apkg_path, operation, verify=not args.no_verify)
+    except ValueError as e:
+        print(f"\n❌ {e}")
+        input("\nAppuyez sur Entrée pour quitter...")
+        sys.exit(1)
 
-    finally:
-        shutil.rmtree(temp_dir)
+    print(f"\n✅ Terminé!")
+    print(f"   📁 Fichier: {output_path}")
+    print(f"   🖼️  Images traitées: {processed_count}")
 
     input("\nAppuyez sur Entrée pour quitter...")
 
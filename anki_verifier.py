@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Vérification des paquets Anki (.apkg)
+=====================================
+Contrôle qu'un paquet produit par learnablemeta_to_anki.py ou
+anki_image_cropper.py est complet et cohérent, sans l'extraire :
+
+- schéma de la collection et nombre de lignes (col, notes, cartes)
+- chaque carte pointe vers une note, un modèle et un deck existants
+- chaque <img src> des notes se résout par le fichier media vers un membre
+  présent de l'archive, dont l'en-tête est celui d'une image
+- aucun média orphelin (déclaré mais jamais référencé, ni par les notes ni
+  par le CSS ou les modèles de carte, ou membre inconnu) ; les médias
+  "_..." des modèles sont acceptés
+
+Les formats legacy (collection.anki2, media JSON) et récent (collection
+zstd, manifeste protobuf, images zstd) sont pris en charge. Les images
+chargées hors de l'archive (URL, ou chemin commençant par l'adresse
+donnée à --media-base-url) ne sont pas vérifiées.
+Seuls les premiers octets de chaque image sont lus ; --deep décompresse
+tout (CRC, taille et SHA-1 du manifeste, décodage Pillow si installé).
+
+UTILISATION:
+    python anki_verifier.py deck.apkg
+    python anki_verifier.py decks/ --deep
+"""
+
+import sys
+import os
+import argparse
+import glob
+import hashlib
+import html
+import io
+import json
+import re
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+from functools import lru_cache
+
+__all__ = ['verify_apkg', 'print_report']
+
+# Tables et colonnes attendues dans la collection (schéma 11)
+_REQUIRED_COLUMNS = {
+    'col': {'id', 'crt', 'mod', 'scm', 'ver', 'models', 'decks', 'dconf', 'tags'},
+    'notes': {'id', 'guid', 'mid', 'mod', 'usn', 'tags', 'flds', 'sfld', 'csum', 'flags', 'data'},
+    'cards': {'id', 'nid', 'did', 'ord', 'mod', 'usn', 'type', 'queue', 'due', 'ivl', 'factor',
+              'reps', 'lapses', 'left', 'odue', 'odid', 'flags', 'data'},
+    'revlog': {'id', 'cid'},
+    'graves': {'oid', 'type'},
+}
+
+# Membres de l'archive qui ne sont pas des médias
+_PACKAGE_MEMBERS = {'collection.anki2', 'collection.anki21', 'collection.anki21b', 'media', 'meta'}
+
+# src entre guillemets doubles, simples ou sans guillemets (data-src exclu)
+_IMG_PATTERN = re.compile(r'''<img[^>]*?(?<![\w-])src\s*=\s*(?:"([^"]+)"|'([^']+)'|([^\s"'>]+))''',
+                          re.IGNORECASE)
+_SOUND_PATTERN = re.compile(r'\[sound:([^\]]+)\]')
+# Références hors de l'archive : toute URL avec un schéma (http:, file:, data:...)
+# ou relative au protocole
+_REMOTE_PATTERN = re.compile(r'^(?:[a-zA-Z][a-zA-Z0-9+.-]*:|//)')
+
+# Nombre d'exemples affichés par catégorie de problème
+REPORT_LIMIT = 10
+
+
+@lru_cache(maxsize=None)
+def _zstandard():
+    """Charge zstandard à la première utilisation (None s'il n'est pas installé)."""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+@lru_cache(maxsize=None)
+def _pil_image():
+    """Charge Pillow (et le support AVIF) à la première utilisation (None s'il n'est pas installé)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        print("⚠️  Pillow non installé : images vérifiées par leur seul en-tête")
+        return None
+    try:
+        import pillow_avif
+    except ImportError:
+        pass
+    return Image
+
+
+def _is_image(header):
+    """Reconnaît les formats d'image courants à leurs premiers octets."""
+    return (header.startswith(b'\x89PNG\r\n\x1a\n')
+            or header.startswith(b'\xff\xd8\xff')
+            or header[:6] in (b'GIF87a', b'GIF89a')
+            or (header[:4] == b'RIFF' and header[8:12] == b'WEBP')
+            or (header[4:8] == b'ftyp' and header[8:12] in (b'avif', b'avis', b'mif1', b'heic'))
+            or header.startswith(b'BM')
+            or header.lstrip().startswith((b'<svg', b'<?xml')))
+
+
+def _read_varint(data, pos):
+    """Décode un varint protobuf ; retourne (valeur, position suivante)."""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _iter_fields(data):
+    """Parcourt les champs d'un message protobuf : (numéro, valeur)."""
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        wire = key & 7
+        if wire == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire == 2:
+            size, pos = _read_varint(data, pos)
+            value = data[pos:pos + size]
+            pos += size
+        else:
+            raise ValueError(f"type protobuf inattendu: {wire}")
+        yield key >> 3, value
+
+
+def _parse_media_entries(data):
+    """
+    Manifeste media récent : MediaEntries { repeated MediaEntry entries = 1 }
+    avec MediaEntry { name = 1; size = 2; sha1 = 3 }. Le membre de la
+    i-ème entrée s'appelle str(i). Retourne {membre: (nom, taille, sha1)}.
+    """
+    entries = {}
+    for number, entry in _iter_fields(data):
+        if number != 1:
+            continue
+        fields = dict(_iter_fields(entry))
+        entries[str(len(entries))] = (fields.get(1, b'').decode('utf-8'), fields.get(2, 0), fields.get(3, b''))
+    return entries
+
+
+def _open_member(zf, name, compressed):
+    """Flux de lecture d'un membre, décompressé du zstd pour le format récent."""
+    stream = zf.open(name)
+    if compressed:
+        return _zstandard().ZstdDecompressor().stream_reader(stream, closefd=True)
+    return stream
+
+
+def _read_media_map(zf, modern):
+    """Lit le fichier media : {membre: (nom, taille, sha1)} (taille et sha1 à None en legacy)."""
+    if 'media' not in zf.namelist():
+        return {}
+    with _open_member(zf, 'media', modern) as stream:
+        data = stream.read()
+    if modern:
+        return _parse_media_entries(data)
+    return {idx: (name, None, None) for idx, name in json.loads(data.decode('utf-8') or '{}').items()}
+
+
+def _check_collection(conn, report, templates):
+    """
+    Schéma, nombre de lignes et références entre tables ; retourne les champs
+    des notes. Le CSS et les modèles de carte sont ajoutés à templates.
+    """
+    errors = report['errors']
+    known = len(errors)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, columns in _REQUIRED_COLUMNS.items():
+        if table not in tables:
+            errors.append(f"table {table} absente")
+            continue
+        missing = columns - {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if missing:
+            errors.append(f"table {table} : colonnes absentes ({', '.join(sorted(missing))})")
+    if len(errors) > known:
+        return
+
+    col_rows = conn.execute('SELECT models, decks FROM col').fetchall()
+    if len(col_rows) != 1:
+        errors.append(f"table col : {len(col_rows)} lignes au lieu d'une")
+        return
+    try:
+        models = json.loads(col_rows[0][0])
+        decks = json.loads(col_rows[0][1])
+    except ValueError as e:
+        errors.append(f"col.models ou col.decks illisible : {e}")
+        return
+
+    report['notes'] = conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+    report['cards'] = conn.execute('SELECT COUNT(*) FROM cards').fetchone()[0]
+
+    orphans = conn.execute('SELECT COUNT(*) FROM cards WHERE nid NOT IN (SELECT id FROM notes)').fetchone()[0]
+    if orphans:
+        errors.append(f"{orphans} cartes sans note")
+    without_cards = conn.execute('SELECT COUNT(*) FROM notes WHERE id NOT IN (SELECT nid FROM cards)').fetchone()[0]
+    if without_cards:
+        errors.append(f"{without_cards} notes sans carte")
+    for (did,) in conn.execute('SELECT DISTINCT did FROM cards'):
+        if str(did) not in decks:
+            errors.append(f"deck {did} référencé par des cartes mais absent de col.decks")
+
+    field_counts = {}
+    for mid, model in models.items():
+        field_counts[mid] = len(model.get('flds', []))
+        templates.append(model.get('css', ''))
+        for tmpl in model.get('tmpls', []):
+            templates.extend((tmpl.get('qfmt', ''), tmpl.get('afmt', '')))
+        templates = len(model.get('tmpls', []))
+        bad = conn.execute('SELECT COUNT(*) FROM cards WHERE ord >= ? AND nid IN '
+                           '(SELECT id FROM notes WHERE mid = ?)', (templates, int(mid))).fetchone()[0]
+        if bad and model.get('type', 0) == 0:
+            errors.append(f"{bad} cartes sans modèle de carte (modèle {mid})")
+
+    bad_model = bad_fields = 0
+    for mid, flds in conn.execute('SELECT mid, flds FROM notes'):
+        expected = field_counts.get(str(mid))
+        if expected is None:
+            bad_model += 1
+            continue
+        fields = flds.split('\x1f')
+        if len(fields) != expected:
+            bad_fields += 1
+        yield fields
+    if bad_model:
+        errors.append(f"{bad_model} notes avec un modèle absent de col.models")
+    if bad_fields:
+        errors.append(f"{bad_fields} notes avec un nombre de champs incorrect")
+
+
+def verify_apkg(path, deep=False, media_base_url=None):
+    """
+    API publique : vérifie un .apkg sans l'extraire. Retourne un rapport
+    (dict) : format, nombre de notes, cartes, médias et références d'images,
+    'errors' (problèmes de structure), 'missing' (images référencées mais
+    absentes), 'corrupt' (membres illisibles ou qui ne sont pas des images),
+    'orphans' (médias jamais référencés), 'empty' (notes sans aucune image,
+    le plus souvent un téléchargement échoué) et 'ok'.
+
+    Avec deep, chaque image est entièrement lue : CRC de l'archive, taille et
+    SHA-1 du manifeste (format récent) et décodage par Pillow s'il est
+    installé.
+
+    Les images dont l'adresse a un schéma (http:, file:...) ou commence par
+    media_base_url (chemin de NAS, adresse relative...) sont comptées dans
+    'remote' sans être vérifiées.
+    """
+    report = {'path': path, 'format': 'legacy', 'notes': 0, 'cards': 0, 'media': 0, 'images': 0,
+              'remote': 0, 'errors': [], 'missing': [], 'corrupt': [], 'orphans': [], 'empty': 0}
+    temp_dir = tempfile.mkdtemp()
+    try:
+        try:
+            zf = zipfile.ZipFile(path)
+        except (OSError, zipfile.BadZipFile) as e:
+            report['errors'].append(f"archive illisible : {e}")
+            return _finish(report)
+        with zf:
+            _verify_archive(zf, report, deep, temp_dir, media_base_url)
+    finally:
+        shutil.rmtree(temp_dir)
+    return _finish(report)
+
+
+def _finish(report):
+    report['ok'] = not (report['errors'] or report['missing'] or report['corrupt'] or report['orphans'])
+    return report
+
+
+def _verify_archive(zf, report, deep, temp_dir, media_base_url=None):
+    names = set(zf.namelist())
+    modern = 'collection.anki21b' in names
+    if modern:
+        report['format'] = 'modern'
+        if _zstandard() is None:
+            report['errors'].append("format récent : zstandard requis pour la vérification (pip install zstandard)")
+            return
+    collection = next((name for name in ('collection.anki21b', 'collection.anki21', 'collection.anki2')
+                       if name in names), None)
+    if collection is None:
+        report['errors'].append("collection absente de l'archive")
+        return
+
+    # SQLite a besoin d'un fichier : seule la collection est extraite
+    db_path = os.path.join(temp_dir, 'collection.db')
+    try:
+        with _open_member(zf, collection, modern) as src, open(db_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        media_map = _read_media_map(zf, modern)
+    except Exception as e:
+        report['errors'].append(f"lecture de l'archive impossible : {e}")
+        return
+    report['media'] = len(media_map)
+
+    # Membres de l'archive et entrées du fichier media
+    for idx in sorted(media_map, key=lambda idx: (len(idx), idx)):
+        if idx not in names:
+            report['missing'].append(f"{media_map[idx][0]} (membre {idx} absent)")
+    for name in sorted(names - _PACKAGE_MEMBERS - set(media_map)):
+        report['orphans'].append(f"membre {name} absent du fichier media")
+    by_name = {}
+    for idx, entry in media_map.items():
+        if entry[0] in by_name:
+            report['errors'].append(f"média déclaré deux fois : {entry[0]}")
+        by_name[entry[0]] = idx
+
+    # Références des notes
+    referenced = set()
+    images = set()
+    templates = []
+    conn = sqlite3.connect(db_path)
+    try:
+        for fields in _check_collection(conn, report, templates):
+            has_image = False
+            for field in fields:
+                for match in _IMG_PATTERN.finditer(field):
+                    has_image = True
+                    src = html.unescape(next(group for group in match.groups() if group))
+                    if _REMOTE_PATTERN.match(src) or (media_base_url and src.startswith(media_base_url)):
+                        report['remote'] += 1
+                    else:
+                        images.add(src)
+                for sound in _SOUND_PATTERN.findall(field):
+                    referenced.add(html.unescape(sound))
+            if not has_image:
+                report['empty'] += 1
+    except sqlite3.DatabaseError as e:
+        report['errors'].append(f"collection illisible : {e}")
+        return
+    finally:
+        conn.close()
+    referenced |= images
+    report['images'] = len(images)
+
+    for src in sorted(images):
+        idx = by_name.get(src)
+        if idx is None:
+            report['missing'].append(src)
+        elif idx in names:
+            problem = _check_image(zf, idx, media_map[idx], modern, deep)
+            if problem:
+                report['corrupt'].append(f"{src} : {problem}")
+    # Les médias "_..." sont ceux des modèles (polices, scripts) : Anki les
+    # conserve sans référence ; les autres peuvent être cités par le CSS ou
+    # les modèles de carte
+    template_text = '\n'.join(templates)
+    for name in sorted(set(by_name) - referenced):
+        if not name.startswith('_') and name not in template_text:
+            report['orphans'].append(name)
+
+
+def _check_image(zf, idx, entry, modern, deep):
+    """Retourne None si le membre est une image lisible, sinon la raison."""
+    try:
+        with _open_member(zf, idx, modern) as stream:
+            if not deep:
+                return None if _is_image(stream.read(32)) else "pas une image"
+            data = stream.read()
+    except Exception as e:
+        return f"illisible ({e})"
+    if not _is_image(data[:32]):
+        return "pas une image"
+    _, size, sha1 = entry
+    if size is not None and size != len(data):
+        return f"taille {len(data)} au lieu de {size}"
+    if sha1 and hashlib.sha1(data).digest() != sha1:
+        return "SHA-1 différent du manifeste"
+    Image = _pil_image()
+    if Image is not None and not data.lstrip().startswith((b'<svg', b'<?xml')):
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                img.load()
+        except Exception as e:
+            return f"non décodable ({e})"
+    return None
+
+
+def print_report(report, limit=REPORT_LIMIT):
+    """Affiche un rapport de verify_apkg ; les listes sont tronquées à limit exemples."""
+    name = os.path.basename(report['path'])
+    if report['ok']:
+        print(f"  🔍 {name} : ✓ {report['notes']} notes, {report['cards']} cartes, "
+              f"{report['media']} médias ({report['format']})")
+    else:
+        print(f"  🔍 {name} : ✗ paquet incohérent ({report['format']})")
+    for key, label in (('errors', "Structure"), ('missing', "Images manquantes"),
+                       ('corrupt', "Images illisibles"), ('orphans', "Médias orphelins")):
+        items = report[key]
+        if not items:
+            continue
+        print(f"     ❌ {label} : {len(items)}")
+        for item in items[:limit]:
+            print(f"        - {item}")
+        if len(items) > limit:
+            print(f"        ... et {len(items) - limit} autres")
+    if report['empty']:
+        print(f"     ⚠️  Notes sans image : {report['empty']}")
+    if report['remote']:
+        print(f"     🌐 Images distantes non vérifiées : {report['remote']}")
+
+
+def _expand(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.apkg')
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vérifie l'intégrité de paquets Anki (.apkg).")
+    parser.add_argument('apkg', nargs='+', help="Fichiers .apkg, dossiers ou motifs glob")
+    parser.add_argument('--deep', action='store_true',
+                        help="Lire et décoder chaque image entièrement (plus lent)")
+    parser.add_argument('--limit', type=int, default=REPORT_LIMIT,
+                        help=f"Nombre d'exemples affichés par problème (défaut: {REPORT_LIMIT})")
+    parser.add_argument('--media-base-url', metavar='URL',
+                        help="Adresse des images non embarquées (chemin de NAS, adresse relative...)")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for path in _expand(args.apkg):
+        report = verify_apkg(path, deep=args.deep, media_base_url=args.media_base_url)
+        print_report(report, args.limit)
+        failures += not report['ok']
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Écriture parallèle des paquets Anki (.apkg)
+===========================================
+Compresse les membres d'une archive ZIP sur un pool de threads (zlib libère
+le GIL) puis les écrit dans l'ordre de soumission : l'archive produite est
+identique quel que soit le nombre de cœurs. Les gros fichiers (la collection
+SQLite) sont découpés en blocs compressés en parallèle, comme pigz ; les
+gros membres stockés (collection zstd) sont eux aussi copiés par blocs.
+
+Le niveau de compression se règle par type de membre :
+    'collection'  collection.anki2 / collection.anki21b
+    'media'       manifeste des médias
+    'image'       images (déjà compressées : stockées telles quelles par défaut)
+    'stored'      membres déjà compressés (zstd), jamais recompressés
+Un niveau None signifie ZIP_STORED.
+
+L'attribut comment (octets) est écrit comme commentaire de l'archive. Si
+une exception traverse le bloc with, l'archive est abandonnée et supprimée.
+"""
+
+import os
+import time
+import zlib
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ['ParallelZipWriter', 'DEFAULT_LEVELS']
+
+DEFAULT_LEVELS = {
+    'collection': 6,
+    'media': 6,
+    'image': None,
+    'stored': None,
+}
+
+# Taille des blocs compressés indépendamment pour les gros membres
+CHUNK_SIZE = 1 << 20
+
+
+def _deflate(data, level, final):
+    """Compresse un bloc en deflate brut ; les blocs non finaux se terminent par un Z_SYNC_FLUSH."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def _encode(data, level, transform, final):
+    """Tâche exécutée dans le pool : transformation éventuelle puis compression."""
+    if transform is not None:
+        data = transform(data)
+    payload = data if level is None else _deflate(data, level, final)
+    return data, payload
+
+
+class ParallelZipWriter:
+    """
+    Remplaçant de zipfile.ZipFile(path, 'w') pour l'écriture : write() et
+    writestr() rendent la main aussitôt, la compression se fait dans le pool
+    et les membres sont écrits dans l'ordre où ils ont été soumis.
+    """
+
+    def __init__(self, path, levels=None, workers=None, chunk_size=CHUNK_SIZE):
+        self.levels = dict(DEFAULT_LEVELS, **(levels or {}))
+        self.chunk_size = chunk_size
+        self.path = path
+        self._zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self._window = 4 * self._pool._max_workers
+        self._pending = deque()
+        self.comment = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, filename, arcname, kind='image', transform=None):
+        """
+        Ajoute un fichier ; les gros fichiers sont lus et écrits par blocs
+        (compressés en parallèle, ou stockés tels quels) pour borner la mémoire.
+        """
+        size = os.path.getsize(filename)
+        if transform is None and size > self.chunk_size:
+            self._write_chunked(filename, arcname, kind, size)
+            return
+        with open(filename, 'rb') as f:
+            data = f.read()
+        self.writestr(arcname, data, kind, transform)
+
+    def writestr(self, arcname, data, kind='image', transform=None):
+        """Ajoute un membre à partir d'octets (transform est appliqué dans le pool)."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        level = self.levels[kind]
+        future = self._pool.submit(_encode, data, level, transform, True)
+        self._submit(arcname, level, future, size_hint=len(data))
+
+    def close(self):
+        """Écrit les membres restants et termine l'archive."""
+        if self._zf is None:
+            return
+        try:
+            self._drain(0)
+            self._zf.comment = self.comment
+        finally:
+            self._pool.shutdown()
+            self._zf.close()
+            self._zf = None
+
+    def abort(self):
+        """Abandonne l'archive sans la terminer et supprime le fichier."""
+        if self._zf is None:
+            return
+        self._pool.shutdown(cancel_futures=True)
+        fp, self._zf.fp = self._zf.fp, None
+        self._zf = None
+        fp.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _write_chunked(self, filename, arcname, kind, size):
+        # Les membres en attente passent d'abord, puis les blocs sont écrits
+        # au fil de l'eau : la mémoire reste bornée par la fenêtre
+        self._drain(0)
+        level = self.levels[kind]
+        member = self._begin_member(arcname, level, size)
+        inflight = deque()
+        with open(filename, 'rb') as f:
+            offset = 0
+            while offset < size:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                offset += len(data)
+                inflight.append(self._pool.submit(_encode, data, level, None, offset >= size))
+                while inflight and (len(inflight) > self._window or inflight[0].done()):
+                    self._write_payload(member, inflight.popleft())
+        while inflight:
+            self._write_payload(member, inflight.popleft())
+        self._end_member(member)
+
+    def _submit(self, arcname, level, future, size_hint):
+        self._pending.append((arcname, level, future, size_hint))
+        self._drain(self._window)
+
+    def _drain(self, limit):
+        # Écrire dans l'ordre les membres prêts (ou tous ceux au-delà de la fenêtre)
+        while self._pending:
+            arcname, level, future, size_hint = self._pending[0]
+            if len(self._pending) <= limit and not future.done():
+                return
+            self._pending.popleft()
+            member = self._begin_member(arcname, level, size_hint)
+            self._write_payload(member, future)
+            self._end_member(member)
+
+    # Les membres déjà compressés sont écrits en passant par les structures
+    # internes de zipfile, qui n'offre pas d'API pour des données brutes.
+
+    def _begin_member(self, arcname, level, size_hint):
+        """Écrit un en-tête provisoire, réécrit une fois CRC et tailles connus."""
+        zf = self._zf
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED if level is None else zipfile.ZIP_DEFLATED
+        info.external_attr = 0o600 << 16
+        info.CRC = info.file_size = info.compress_size = 0
+        zf._writecheck(info)
+        zf._didModify = True
+        info.header_offset = zf.fp.tell()
+        zip64 = size_hint * 1.05 > zipfile.ZIP64_LIMIT
+        zf.fp.write(info.FileHeader(zip64))
+        return info, zip64
+
+    def _write_payload(self, member, future):
+        info, _ = member
+        data, payload = future.result()
+        info.CRC = zlib.crc32(data, info.CRC)
+        info.file_size += len(data)
+        info.compress_size += len(payload)
+        self._zf.fp.write(payload)
+
+    def _end_member(self, member):
+        info, zip64 = member
+        zf = self._zf
+        end = zf.fp.tell()
+        zf.fp.seek(info.header_offset)
+        zf.fp.write(info.FileHeader(zip64))
+        zf.fp.seek(end)
+        zf.filelist.append(info)
+        zf.NameToInfo[info.filename] = info
+        zf.start_dir = end
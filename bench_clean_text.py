@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la normalisation du texte
+======================================
+Mesure le débit de clean_text et du parsing du tableau metaList sur des
+données synthétiques (échappements \\uXXXX, entités, mojibake, balises).
+
+UTILISATION:
+    python bench_clean_text.py [nombre de notes]
+"""
+
+import sys
+import time
+import contextlib
+import io
+
+from learnablemeta_to_anki import clean_text, iter_metas_from_content
+
+
+PLAIN_NOTE = (
+    "Many buildings in the Nevşehir Province are built by large, light and "
+    "unevenly coloured, sandstone bricks.  Les toits sont plats et l'été est chaud."
+)
+
+SAMPLE_NOTES = [
+    # Texte sain
+    PLAIN_NOTE,
+    # UTF-8 lu comme du latin-1 (mojibake)
+    PLAIN_NOTE.encode('utf-8').decode('latin-1'),
+    # Balises échappées en \uXXXX, entités et espaces multiples
+    r"Les bâtiments \u003Cb\u003Esont\u003C/b\u003E en grès clair &amp; irrégulier.  "
+    "<a href='https://example.com'>voir</a><br>   Les toits&nbsp;sont plats.",
+]
+
+
+def make_texts(count):
+    """Notes synthétiques, légèrement différentes pour éviter tout cache."""
+    return [f"{SAMPLE_NOTES[i % len(SAMPLE_NOTES)]} #{i}" for i in range(count)]
+
+
+def make_page(texts):
+    """Page factice contenant un tableau metaList au format JavaScript."""
+    objects = ",".join(
+        f'{{id:{i},name:"Architecture - Sandstone {i}",note:"{text}",'
+        f'images:["https://example.com/img{i}.png"],locationsCount:"3"}}'
+        for i, text in enumerate(texts)
+    )
+    return f"<html><script>data={{metaList:[{objects}]}}</script></html>"
+
+
+def bench(label, func, count, size):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed * 1000:8.1f} ms   "
+          f"{count / elapsed:10.0f} notes/s   {size / elapsed / 1e6:6.1f} Mo/s")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    texts = make_texts(count)
+    page = make_page(texts)
+    size = sum(len(text) for text in texts)
+
+    print(f"📊 {count} notes ({size / 1e6:.1f} Mo de texte)")
+    bench("clean_text", lambda: [clean_text(text) for text in texts], count, size)
+    bench("clean_text (formatage)", lambda: [clean_text(text, True) for text in texts], count, size)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        parsed = sum(1 for _ in iter_metas_from_content(page))
+    elapsed = time.perf_counter() - start
+    print(f"  {'metaList → metas':<28} {elapsed * 1000:8.1f} ms   "
+          f"{parsed / elapsed:10.0f} notes/s   {len(page) / elapsed / 1e6:6.1f} Mo/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+LearnableMeta : reconstruction planifiée des decks
+==================================================
+Surveille une liste de maps LearnableMeta, vérifie périodiquement si leur
+contenu a changé (empreinte du tableau metaList, voir metalist_digest) et ne reconstruit que les
+decks modifiés. Les reconstructions passent par une file de tâches
+persistante (SQLite) et un pool borné de processus : un arrêt en cours de
+route reprend là où il s'était arrêté au prochain lancement.
+
+La page est d'abord récupérée en HTTP simple (requête conditionnelle
+ETag / Last-Modified) ; Playwright n'est utilisé que si le tableau metaList
+n'est pas présent dans le HTML statique.
+
+UTILISATION:
+    python learnablemeta_daemon.py --config daemon.json
+    python learnablemeta_daemon.py <URL1> <URL2> --interval 3600 --workers 2
+    python learnablemeta_daemon.py --config daemon.json --once
+
+Exemple de daemon.json :
+    {
+        "maps": ["https://learnablemeta.com/maps/695ef651a450338d7979829f"],
+        "interval": 3600,
+        "workers": 2,
+        "output_dir": "decks",
+        "format": "legacy"
+    }
+"""
+
+import sys
+import os
+import argparse
+import re
+import time
+import json
+import sqlite3
+import threading
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from learnablemeta_to_anki import (
+    _requests, clean_text, create_anki_package, find_meta_list, iter_metas_from_content,
+    load_page, metalist_digest, output_filename, package_digest, read_package_digest,
+)
+
+__all__ = ['JobQueue', 'fetch_page', 'load_map', 'check_map', 'run_job', 'run_daemon']
+
+# Intervalle par défaut entre deux vérifications d'une map (secondes)
+CHECK_INTERVAL = 3600
+
+# Nombre de reconstructions simultanées
+BUILD_WORKERS = 2
+
+# Nouvelles tentatives d'une reconstruction échouée
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 60
+
+_TITLE_PATTERN = re.compile(r'<h1[^>]*>(.*?)</h1>', re.DOTALL | re.IGNORECASE)
+
+# seen_fingerprint : empreinte du metaList (metalist_digest) à la dernière
+# vérification ; built_fingerprint : empreinte du paquet construit
+# (package_digest), NULL s'il était incomplet
+_STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS maps (
+    url text PRIMARY KEY,
+    seen_fingerprint text,
+    built_fingerprint text,
+    etag text,
+    last_modified text,
+    checked_at real,
+    built_at real,
+    title text,
+    output_path text
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id integer PRIMARY KEY,
+    url text NOT NULL,
+    fingerprint text,
+    status text NOT NULL,
+    attempts integer NOT NULL DEFAULT 0,
+    not_before real NOT NULL DEFAULT 0,
+    enqueued_at real NOT NULL,
+    started_at real,
+    finished_at real,
+    error text
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, not_before);
+'''
+
+
+class JobQueue:
+    """
+    File de tâches et état des maps, persistés dans une base SQLite.
+
+    Statuts d'une tâche : pending → running → done, ou failed après
+    MAX_ATTEMPTS échecs. Une map n'a jamais plus d'une tâche en attente.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(_STATE_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def recover(self):
+        """Remet en attente les tâches interrompues par un arrêt brutal."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'pending', started_at = NULL WHERE status = 'running'"
+            ).rowcount
+
+    def map_state(self, url):
+        """État connu d'une map (dict), ou None si elle n'a jamais été vérifiée."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM maps WHERE url = ?", (url,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip((column[0] for column in cursor.description), row))
+
+    def record_check(self, url, fingerprint, etag=None, last_modified=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO maps (url, seen_fingerprint, etag, last_modified, checked_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET "
+                "seen_fingerprint = excluded.seen_fingerprint, etag = excluded.etag, "
+                "last_modified = excluded.last_modified, checked_at = excluded.checked_at",
+                (url, fingerprint, etag, last_modified, time.time())
+            )
+
+    def enqueue(self, url, fingerprint):
+        """Ajoute une reconstruction, sauf si la map en a déjà une en cours. Retourne l'id ou None."""
+        with self._lock:
+            busy = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE url = ? AND status IN ('pending', 'running')", (url,)
+            ).fetchone()
+            if busy:
+                return None
+            return self._conn.execute(
+                "INSERT INTO jobs (url, fingerprint, status, enqueued_at) VALUES (?, ?, 'pending', ?)",
+                (url, fingerprint, time.time())
+            ).lastrowid
+
+    def claim(self):
+        """Prend la plus ancienne tâche prête. Retourne (id, url) ou None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, url FROM jobs WHERE status = 'pending' AND not_before <= ? "
+                "ORDER BY id LIMIT 1", (time.time(),)
+            ).fetchone()
+            if row:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1 "
+                    "WHERE id = ?", (time.time(), row[0])
+                )
+            return row
+
+    def finish(self, job_id, url, result):
+        """Marque la tâche terminée et enregistre l'empreinte effectivement construite."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, fingerprint = ?, error = NULL "
+                "WHERE id = ?", (now, result['fingerprint'], job_id)
+            )
+            self._conn.execute(
+                "UPDATE maps SET built_fingerprint = ?, built_at = ?, title = ?, output_path = ? "
+                "WHERE url = ?",
+                (result['fingerprint'], now, result['title'], result['output_path'], url)
+            )
+            self._conn.execute("COMMIT")
+
+    def fail(self, job_id, error):
+        """Replanifie la tâche avec un délai croissant, ou l'abandonne après MAX_ATTEMPTS essais."""
+        with self._lock:
+            attempts, = self._conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if attempts < MAX_ATTEMPTS:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'pending', not_before = ?, error = ? WHERE id = ?",
+                    (time.time() + RETRY_DELAY * attempts, error, job_id)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                    (time.time(), error, job_id)
+                )
+            return attempts < MAX_ATTEMPTS
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+
+
+def fetch_page(url, etag=None, last_modified=None):
+    """
+    Récupère une page en HTTP, avec une requête conditionnelle si possible.
+    Retourne (contenu, etag, last_modified) ; contenu vaut None si la page
+    n'a pas changé (304).
+    """
+    requests = _requests()
+    if requests is None:
+        raise RuntimeError("requests est requis pour surveiller les maps")
+
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    response = requests.get(url, timeout=30, headers=headers)
+    if response.status_code == 304:
+        return None, etag, last_modified
+    response.raise_for_status()
+    return response.text, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+
+def page_title(page_content):
+    """Titre du deck (premier <h1>) extrait du HTML statique."""
+    match = _TITLE_PATTERN.search(page_content)
+    title = clean_text(match.group(1)) if match else ""
+    return title or "LearnableMeta Deck"
+
+
+def load_map(url, context=None):
+    """
+    Code source et titre d'une map : HTTP simple d'abord, Playwright si le
+    tableau metaList n'est pas rendu côté serveur (dans context s'il est fourni).
+    """
+    page_content, _, _ = fetch_page(url)
+    if find_meta_list(page_content):
+        return page_content, page_title(page_content)
+    page_content, deck_title = load_page(url, context=context)
+    if page_content is None:
+        raise RuntimeError("metaList absent du HTML et Playwright indisponible")
+    return page_content, deck_title
+
+
+def check_map(queue, url, package_format='legacy', keep_formatting=False):
+    """
+    Vérifie une map et met en file sa reconstruction si son contenu ou les
+    options de construction (voir package_digest) ont changé. Retourne True
+    si une reconstruction a été ajoutée.
+    """
+    state = queue.map_state(url) or {}
+    page_content, etag, last_modified = fetch_page(url, state.get('etag'), state.get('last_modified'))
+    if page_content is None:
+        fingerprint = state.get('seen_fingerprint')
+    else:
+        fingerprint = metalist_digest(page_content)
+        if fingerprint is None:
+            # Page rendue côté client : empreinte calculée sur la page chargée par Playwright
+            page_content, _ = load_page(url)
+            fingerprint = metalist_digest(page_content or "")
+            etag = last_modified = None
+    queue.record_check(url, fingerprint, etag, last_modified)
+
+    # Le deck construit est identifié par l'empreinte du paquet : changer de
+    # format, d'options ou de DIGEST_VERSION provoque une reconstruction, de
+    # même qu'un deck supprimé ou remplacé depuis
+    digest = package_digest(fingerprint, package_format, keep_formatting) if fingerprint else None
+    output_path = state.get('output_path')
+    if (digest is not None and digest == state.get('built_fingerprint')
+            and output_path and read_package_digest(output_path) == digest):
+        return False
+    return queue.enqueue(url, digest) is not None
+
+
+def run_job(url, output_dir, package_format='legacy', keep_formatting=False):
+    """
+    Reconstruit le deck d'une map (exécuté dans un processus du pool).
+    La sortie du builder va dans <output_dir>/logs/ et les images sont
+    gardées d'une reconstruction à l'autre dans <output_dir>/media/ ; le
+    .apkg est écrit dans un fichier temporaire puis renommé, pour ne jamais
+    exposer un paquet incomplet.
+
+    Retourne l'empreinte du paquet construit (voir package_digest), ou None
+    si des images manquent : la map sera alors reconstruite au cycle suivant.
+    """
+    log_dir = os.path.join(output_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    map_id = re.sub(r'[^\w-]', '_', url.rstrip('/').split('/')[-1])[:40] or 'map'
+    log_path = os.path.join(log_dir, f"{map_id}.log")
+
+    with open(log_path, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        page_content, deck_title = load_map(url)
+        fingerprint = metalist_digest(page_content)
+        digest = package_digest(fingerprint, package_format, keep_formatting)
+        output_path = os.path.join(output_dir, output_filename(url, deck_title))
+        if read_package_digest(output_path) == digest:
+            # Déjà construit (base d'état perdue ou tâche rejouée)
+            return {'fingerprint': digest, 'title': deck_title, 'output_path': output_path}
+
+        metas = iter_metas_from_content(page_content, keep_formatting)
+        first = next(metas, None)
+        if first is None:
+            raise RuntimeError("aucune meta trouvée")
+
+        def chained():
+            yield first
+            yield from metas
+
+        partial_path = output_path + '.part'
+        try:
+            create_anki_package(chained(), deck_title, partial_path, package_format=package_format,
+                                media_cache=os.path.join(output_dir, 'media'), digest=digest)
+            os.replace(partial_path, output_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    # Sans empreinte dans le paquet (images manquantes), rien n'est marqué construit
+    return {'fingerprint': read_package_digest(output_path), 'title': deck_title, 'output_path': output_path}
+
+
+def load_config(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def run_daemon(maps, output_dir, state_path, interval=CHECK_INTERVAL, workers=BUILD_WORKERS,
+               package_format='legacy', keep_formatting=False, once=False, stop=None, config_path=None):
+    """
+    Boucle principale : vérification des maps toutes les interval secondes
+    et exécution des reconstructions en file sur au plus workers processus.
+
+    Avec config_path, les maps du fichier sont relues à chaque cycle et
+    s'ajoutent à maps. Avec once,
+    un seul cycle est effectué et la fonction rend la main quand la file est
+    vide. stop (threading.Event) permet d'arrêter la boucle depuis un autre thread.
+    """
+    stop = stop or threading.Event()
+    os.makedirs(output_dir, exist_ok=True)
+    queue = JobQueue(state_path)
+    recovered = queue.recover()
+    if recovered:
+        print(f"♻️  {recovered} reconstruction(s) interrompue(s) remise(s) en file")
+
+    running = {}
+    next_check = 0
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while not stop.is_set():
+            now = time.time()
+            if now >= next_check:
+                watched = maps
+                if config_path:
+                    watched = list(dict.fromkeys(load_config(config_path).get('maps', []) + list(maps)))
+                print(f"\n🔎 [{time.strftime('%H:%M:%S')}] Vérification de {len(watched)} map(s)...")
+                for url in watched:
+                    try:
+                        if check_map(queue, url, package_format, keep_formatting):
+                            print(f"  🔄 {url} : modifiée, reconstruction en file")
+                        else:
+                            print(f"  ✓ {url} : inchangée")
+                    except Exception as e:
+                        print(f"  ⚠️ {url} : {e}")
+                next_check = now + interval
+
+            # Remplir le pool sans dépasser workers reconstructions simultanées
+            while len(running) < workers:
+                job = queue.claim()
+                if job is None:
+                    break
+                job_id, url = job
+                print(f"  🏗️  Reconstruction de {url}...")
+                future = pool.submit(run_job, url, output_dir, package_format, keep_formatting)
+                running[future] = job
+
+            if once and not running:
+                break
+
+            timeout = max(0.1, min(next_check - time.time(), 1.0))
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id, url = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    retry = queue.fail(job_id, str(e) or type(e).__name__)
+                    print(f"  ❌ {url} : {e}" + (" (nouvel essai plus tard)" if retry else ""))
+                else:
+                    queue.finish(job_id, url, result)
+                    print(f"  ✅ {url} → {result['output_path']}")
+    finally:
+        # Les tâches encore en cours restent 'running' et seront reprises au prochain lancement
+        for future in running:
+            future.cancel()
+        pool.shutdown(wait=not running)
+        queue.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reconstruit automatiquement les decks des maps LearnableMeta modifiées.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Exemple: python learnablemeta_daemon.py --config daemon.json",
+    )
+    parser.add_argument('urls', nargs='*', metavar='url', help="Maps à surveiller (en plus de --config)")
+    parser.add_argument('--config', help="Fichier JSON de configuration (relu à chaque cycle)")
+    parser.add_argument('--interval', type=float, help=f"Secondes entre deux vérifications (défaut: {CHECK_INTERVAL})")
+    parser.add_argument('--workers', type=int, help=f"Reconstructions simultanées (défaut: {BUILD_WORKERS})")
+    parser.add_argument('--output-dir', help="Dossier des .apkg (défaut: decks)")
+    parser.add_argument('--state', help="Base SQLite de la file et de l'état (défaut: <output-dir>/daemon.db)")
+    parser.add_argument('--format', choices=['legacy', 'modern'], help="Format des paquets (défaut: legacy)")
+    parser.add_argument('--keep-formatting', action='store_true',
+                        help="Conserver le gras, l'italique et les liens des descriptions")
+    parser.add_argument('--once', action='store_true', help="Un seul cycle puis arrêt quand la file est vide")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config) if args.config else {}
+    maps = list(dict.fromkeys(config.get('maps', []) + args.urls))
+    output_dir = args.output_dir or config.get('output_dir', 'decks')
+
+    print("=" * 60)
+    print("  LearnableMeta → Anki : reconstruction planifiée")
+    print("=" * 60)
+
+    if not maps:
+        print(__doc__)
+        print("\n❌ Aucune map à surveiller!")
+        sys.exit(1)
+
+    if _requests() is None:
+        print("\n❌ requests n'est pas installé! (pip install requests)")
+        sys.exit(1)
+
+    try:
+        run_daemon(
+            args.urls,
+            output_dir,
+            args.state or config.get('state') or os.path.join(output_dir, 'daemon.db'),
+            interval=args.interval or config.get('interval', CHECK_INTERVAL),
+            workers=args.workers or config.get('workers', BUILD_WORKERS),
+            package_format=args.format or config.get('format', 'legacy'),
+            keep_formatting=args.keep_formatting or config.get('keep_formatting', False),
+            once=args.once,
+            config_path=args.config,
+        )
+    except KeyboardInterrupt:
+        print("\n⏹️  Arrêt demandé, les reconstructions en cours reprendront au prochain lancement")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+LearnableMeta : serveur de construction de decks à la demande
+=============================================================
+Serveur HTTP local qui reçoit l'URL d'une map et renvoie le .apkg construit.
+Le processus reste lancé entre les requêtes :
+    - chaque worker garde un navigateur Playwright chaud (utilisé seulement
+      si la map n'est pas rendue côté serveur) ;
+    - les images téléchargées sont partagées entre toutes les requêtes ;
+    - un deck dont le tableau metaList n'a pas changé est renvoyé depuis le
+      cache sans être reconstruit.
+Les requêtes en trop sont refusées (503 + Retry-After) au lieu de
+s'accumuler : au plus --workers constructions simultanées et --queue-size
+en attente.
+
+UTILISATION:
+    python learnablemeta_server.py --port 8000 --workers 2
+    curl -OJ "http://127.0.0.1:8000/build?url=https://learnablemeta.com/maps/695ef651a450338d7979829f"
+
+Paramètres de /build : url (obligatoire), format=legacy|modern,
+keep_formatting=1. /health renvoie l'état du serveur en JSON. /media/<nom>
+sert les images du cache, ce qui en fait un serveur d'images pour les decks
+construits avec --media-base-url http://127.0.0.1:8000/media/.
+"""
+
+import sys
+import os
+import argparse
+import time
+import json
+import glob
+import hashlib
+import mimetypes
+import queue
+import shutil
+import threading
+from concurrent.futures import Future, TimeoutError as BuildTimeout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+
+from learnablemeta_to_anki import (
+    _requests, _sync_playwright, create_anki_package, iter_metas_from_content, metalist_digest,
+    new_browser_context, output_filename, package_digest, read_package_digest,
+)
+from learnablemeta_daemon import load_map
+
+__all__ = ['BuildService', 'serve']
+
+# Constructions simultanées (un navigateur chaud par worker)
+SERVER_WORKERS = 2
+
+# Requêtes acceptées en attente d'un worker avant de répondre 503
+QUEUE_SIZE = 8
+
+# Temps maximal d'une construction avant de répondre 504 (secondes)
+BUILD_TIMEOUT = 600
+
+_STOP = object()
+
+
+class _ThreadStdout:
+    """
+    Remplace sys.stdout pour que chaque thread puisse rediriger ses print()
+    (contextlib.redirect_stdout agit sur tout le processus).
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+
+    def redirect(self, stream):
+        self._local.stream = stream
+
+    def write(self, text):
+        return getattr(self._local, 'stream', self.default).write(text)
+
+    def flush(self):
+        getattr(self._local, 'stream', self.default).flush()
+
+
+class BuildService:
+    """
+    Pool borné de workers de construction, chacun avec son navigateur
+    Playwright (l'API synchrone de Playwright est liée à son thread).
+    """
+
+    def __init__(self, cache_dir, workers=SERVER_WORKERS, queue_size=QUEUE_SIZE, verbose=False):
+        self.media_dir = os.path.join(cache_dir, 'media')
+        self.deck_dir = os.path.join(cache_dir, 'decks')
+        os.makedirs(self.media_dir, exist_ok=True)
+        os.makedirs(self.deck_dir, exist_ok=True)
+        self.verbose = verbose
+        self.stats = {'builds': 0, 'hits': 0, 'rejected': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, url, package_format='legacy', keep_formatting=False):
+        """
+        Met une construction en file. Retourne un Future dont le résultat est
+        (chemin du .apkg, nom de fichier, servi depuis le cache), ou lève
+        queue.Full si le serveur est saturé.
+        """
+        future = Future()
+        try:
+            self._jobs.put_nowait((future, url, package_format, keep_formatting))
+        except queue.Full:
+            self._count('rejected')
+            raise
+        return future
+
+    def queued(self):
+        return self._jobs.qsize()
+
+    def close(self):
+        for _ in self._threads:
+            self._jobs.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _worker(self):
+        if not self.verbose and isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout.redirect(open(os.devnull, 'w'))
+
+        # Navigateur lancé une fois pour toutes (si Playwright est installé)
+        playwright = browser = context = None
+        if _sync_playwright() is not None:
+            try:
+                playwright = _sync_playwright()().start()
+                browser, context = new_browser_context(playwright)
+            except Exception as e:
+                print(f"⚠️  Navigateur indisponible : {e}", file=sys.stderr)
+
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is _STOP:
+                    break
+                future, url, package_format, keep_formatting = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self._build(url, package_format, keep_formatting, context))
+                except Exception as e:
+                    self._count('errors')
+                    future.set_exception(e)
+        finally:
+            if browser is not None:
+                browser.close()
+            if playwright is not None:
+                playwright.stop()
+
+    def _build(self, url, package_format, keep_formatting, context):
+        page_content, deck_title = load_map(url, context)
+        fingerprint = metalist_digest(page_content) or ""
+        digest = package_digest(fingerprint, package_format, keep_formatting)
+        filename = output_filename(url, deck_title)
+
+        # Un fichier par (map, options) ; le suffixe est l'empreinte du paquet
+        # (contenu, options, DIGEST_VERSION). Un paquet sans empreinte (images
+        # manquantes) n'est pas resservi.
+        key = hashlib.sha256(f"{url}\n{package_format}\n{int(keep_formatting)}".encode()).hexdigest()[:16]
+        cached = os.path.join(self.deck_dir, f"{key}_{hashlib.sha256(digest.encode()).hexdigest()[:16]}.apkg")
+        if read_package_digest(cached) == digest:
+            self._count('hits')
+            return cached, filename, True
+
+        metas = iter_metas_from_content(page_content, keep_formatting)
+        first = next(metas, None)
+        if first is None:
+            raise LookupError("aucune meta trouvée")
+
+        def chained():
+            yield first
+            yield from metas
+
+        partial_path = f"{cached}.{threading.get_ident()}.part"
+        try:
+            create_anki_package(chained(), deck_title, partial_path, package_format=package_format,
+                                media_cache=self.media_dir,
+                                digest=digest)
+            os.replace(partial_path, cached)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        # Les versions précédentes de ce deck ne serviront plus
+        for old in glob.glob(os.path.join(self.deck_dir, f"{key}_*.apkg")):
+            if old != cached:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass  # encore en cours d'envoi à un autre client
+        self._count('builds')
+        return cached, filename, False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "LearnableMeta/1.0"
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if parts.path == '/health':
+            service = self.server.service
+            self._send_json(200, dict(service.stats, queued=service.queued(), workers=len(service._threads)))
+        elif parts.path == '/build':
+            self._build(params)
+        elif parts.path.startswith('/media/'):
+            self._media(unquote(parts.path[len('/media/'):]))
+        else:
+            self._send_json(404, {'error': "chemin inconnu (utiliser /build?url=...)"})
+
+    def _build(self, params):
+        url = params.get('url')
+        package_format = params.get('format', 'legacy')
+        if not url or package_format not in ('legacy', 'modern'):
+            self._send_json(400, {'error': "paramètres attendus : url=<map>[&format=legacy|modern]"})
+            return
+
+        start = time.time()
+        try:
+            future = self.server.service.submit(url, package_format, params.get('keep_formatting') == '1')
+        except queue.Full:
+            self._send_json(503, {'error': "serveur saturé, réessayer plus tard"}, {'Retry-After': '5'})
+            return
+
+        try:
+            path, filename, hit = future.result(timeout=BUILD_TIMEOUT)
+        except BuildTimeout:
+            self._send_json(504, {'error': "construction trop longue"})
+            return
+        except LookupError as e:
+            self._send_json(404, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(502, {'error': f"{type(e).__name__}: {e}"})
+            return
+
+        # Envoi du fichier par blocs, sans le charger en mémoire
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(size))
+            ascii_name = filename.encode('ascii', 'replace').decode().replace('?', '_')
+            self.send_header('Content-Disposition',
+                             f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}")
+            self.send_header('X-Deck-Cache', 'hit' if hit else 'miss')
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+        print(f"  {'⚡' if hit else '🏗️ '} {url} → {filename} ({size / 1e6:.1f} Mo, {time.time() - start:.1f} s)")
+
+    def _media(self, filename):
+        # Le cache d'images sert aussi de serveur pour les decks construits
+        # avec --media-base-url http://<hôte>:<port>/media/
+        path = os.path.join(self.server.service.media_dir, os.path.basename(filename))
+        if not filename or os.path.basename(filename) != filename or not os.path.isfile(path):
+            self._send_json(404, {'error': "image inconnue"})
+            return
+        with open(path, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header('Cache-Control', 'public, max-age=86400')
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Une ligne par construction suffit (voir _build)
+        pass
+
+
+def serve(host='127.0.0.1', port=8000, cache_dir='server_cache', workers=SERVER_WORKERS,
+          queue_size=QUEUE_SIZE, verbose=False, ready=None):
+    """
+    Lance le serveur jusqu'à interruption. ready(serveur) est appelé une
+    fois le port ouvert (serveur.shutdown() l'arrête depuis un autre thread).
+    """
+    if not isinstance(sys.stdout, _ThreadStdout):
+        sys.stdout = _ThreadStdout(sys.stdout)
+    service = BuildService(cache_dir, workers, queue_size, verbose)
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"🚀 Serveur prêt sur http://{host}:{server.server_port}/build?url=<map>")
+    if ready:
+        ready(server)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serveur HTTP local qui construit les decks LearnableMeta à la demande.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Exemple: curl -OJ \"http://127.0.0.1:8000/build?url=https://learnablemeta.com/maps/<id>\"",
+    )
+    parser.add_argument('--host', default='127.0.0.1', help="Adresse d'écoute (défaut: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8000, help="Port d'écoute (défaut: 8000)")
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS,
+                        help=f"Constructions simultanées (défaut: {SERVER_WORKERS})")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                        help=f"Requêtes en attente avant de répondre 503 (défaut: {QUEUE_SIZE})")
+    parser.add_argument('--cache-dir', default='server_cache',
+                        help="Dossier du cache d'images et de decks (défaut: server_cache)")
+    parser.add_argument('--verbose', action='store_true', help="Afficher la sortie complète du builder")
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("  LearnableMeta → Anki : serveur de construction")
+    print("=" * 60)
+
+    if _requests() is None:
+        print("\n❌ requests n'est pas installé! (pip install requests)")
+        sys.exit(1)
+
+    try:
+        serve(args.host, args.port, args.cache_dir, args.workers, args.queue_size, args.verbose)
+    except KeyboardInterrupt:
+        print("\n⏹️  Serveur arrêté")
+
+
+if __name__ == "__main__":
+    main()
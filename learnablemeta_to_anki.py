@@ -14,31 +14,189 @@ UTILISATION:
 
 import sys
 import os
+import argparse
 import re
 import time
 import json
+import html
 import sqlite3
-import zipfile
 import hashlib
 import tempfile
 import shutil
+import queue
+import threading
+import zipfile
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from urllib.parse import quote, unquote
+
+from anki_verifier import verify_apkg, print_report
+from anki_zip import ParallelZipWriter
+
+__all__ = ['extract', 'build_apkg', 'build_from_url', 'load_page', 'extract_metas_from_page',
+           'create_anki_package', 'metalist_digest', 'package_digest', 'read_package_digest',
+           'image_filename', 'cache_filename', 'make_thumbnail', 'media_bundle_path']
+
+# Nombre de téléchargements d'images en parallèle
+DOWNLOAD_WORKERS = 8
+
+# Taille maximale (px) des miniatures du verso ; 0 pour y mettre l'image complète
+THUMBNAIL_SIZE = 480
+
+# Schéma Anki 2.1 (collection legacy, schéma 11)
+_COLLECTION_SCHEMA = '''
+    CREATE TABLE col (
+        id INTEGER PRIMARY KEY,
+        crt INTEGER NOT NULL,
+        mod INTEGER NOT NULL,
+        scm INTEGER NOT NULL,
+        ver INTEGER NOT NULL,
+        dty INTEGER NOT NULL,
+        usn INTEGER NOT NULL,
+        ls INTEGER NOT NULL,
+        conf TEXT NOT NULL,
+        models TEXT NOT NULL,
+        decks TEXT NOT NULL,
+        dconf TEXT NOT NULL,
+        tags TEXT NOT NULL
+    );
+    
+    CREATE TABLE notes (
+        id INTEGER PRIMARY KEY,
+        guid TEXT NOT NULL,
+        mid INTEGER NOT NULL,
+        mod INTEGER NOT NULL,
+        usn INTEGER NOT NULL,
+        tags TEXT NOT NULL,
+        flds TEXT NOT NULL,
+        sfld TEXT NOT NULL,
+        csum INTEGER NOT NULL,
+        flags INTEGER NOT NULL,
+        data TEXT NOT NULL
+    );
+    
+    CREATE TABLE cards (
+        id INTEGER PRIMARY KEY,
+        nid INTEGER NOT NULL,
+        did INTEGER NOT NULL,
+        ord INTEGER NOT NULL,
+        mod INTEGER NOT NULL,
+        usn INTEGER NOT NULL,
+        type INTEGER NOT NULL,
+        queue INTEGER NOT NULL,
+        due INTEGER NOT NULL,
+        ivl INTEGER NOT NULL,
+        factor INTEGER NOT NULL,
+        reps INTEGER NOT NULL,
+        lapses INTEGER NOT NULL,
+        left INTEGER NOT NULL,
+        odue INTEGER NOT NULL,
+        odid INTEGER NOT NULL,
+        flags INTEGER NOT NULL,
+        data TEXT NOT NULL
+    );
+    
+    CREATE TABLE revlog (
+        id INTEGER PRIMARY KEY,
+        cid INTEGER NOT NULL,
+        usn INTEGER NOT NULL,
+        ease INTEGER NOT NULL,
+        ivl INTEGER NOT NULL,
+        lastIvl INTEGER NOT NULL,
+        factor INTEGER NOT NULL,
+        time INTEGER NOT NULL,
+        type INTEGER NOT NULL
+    );
+    
+    CREATE TABLE graves (
+        usn INTEGER NOT NULL,
+        oid INTEGER NOT NULL,
+        type INTEGER NOT NULL
+    );
+    
+    CREATE INDEX ix_notes_csum ON notes (csum);
+    CREATE INDEX ix_notes_usn ON notes (usn);
+    CREATE INDEX ix_cards_nid ON cards (nid);
+    CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+    CREATE INDEX ix_cards_usn ON cards (usn);
+    CREATE INDEX ix_revlog_cid ON revlog (cid);
+    CREATE INDEX ix_revlog_usn ON revlog (usn);
+'''
+
+# Format de paquet récent (Anki 2.1.50+) : fichier meta = PackageMetadata
+# protobuf avec version = VERSION_LATEST (3)
+_PACKAGE_META_LATEST = b'\x08\x03'
+
+# Note unique de la collection legacy embarquée dans un paquet récent, pour
+# les versions d'Anki qui ne savent lire que collection.anki2
+_LEGACY_STUB_TEXT = "Ce paquet nécessite Anki 2.1.50 ou plus récent."
 
-# Vérifier si playwright est installé
-try:
-    from playwright.sync_api import sync_playwright
-    PLAYWRIGHT_AVAILABLE = True
-except ImportError:
-    PLAYWRIGHT_AVAILABLE = False
-    print("⚠️  Playwright non installé.")
+# Parsing du tableau metaList embarqué dans la page
+_BRACKET_PATTERN = re.compile(r'[\[\]]')
+_META_PATTERN = re.compile(
+    r'\{id:(\d+),name:"([^"]+)",note:"([^"]*)",images:\[([^\]]*)\],locationsCount:"(\d+)"'
+)
+_IMAGE_URL_PATTERN = re.compile(r'"([^"]+)"')
 
-# Vérifier si requests est installé  
-try:
-    import requests
-    REQUESTS_AVAILABLE = True
-except ImportError:
-    REQUESTS_AVAILABLE = False
-    print("⚠️  requests non installé.")
+# Empreinte enregistrée dans le commentaire ZIP des paquets ; à incrémenter
+# quand la construction change, pour que les anciens paquets soient refaits
+DIGEST_VERSION = 3
+_DIGEST_PREFIX = 'learnablemeta-digest:'
+
+# Marqueurs de fin de flux et de début de map pour les files du pipeline
+_END = object()
+_SECTION = object()
+
+
+@lru_cache(maxsize=None)
+def _sync_playwright():
+    """Charge Playwright à la première utilisation (None s'il n'est pas installé)."""
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        print("⚠️  Playwright non installé.")
+        return None
+    return sync_playwright
+
+
+@lru_cache(maxsize=None)
+def _requests():
+    """Charge requests à la première utilisation (None s'il n'est pas installé)."""
+    try:
+        import requests
+    except ImportError:
+        print("⚠️  requests non installé.")
+        return None
+    return requests
+
+
+@lru_cache(maxsize=None)
+def _zstandard():
+    """Charge zstandard à la première utilisation (None s'il n'est pas installé)."""
+    try:
+        import zstandard
+    except ImportError:
+        print("⚠️  zstandard non installé.")
+        return None
+    return zstandard
+
+
+@lru_cache(maxsize=None)
+def _pil_image():
+    """Charge Pillow à la première utilisation (None s'il n'est pas installé)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        print("⚠️  Pillow non installé : pas de miniatures (pip install Pillow)")
+        return None
+    try:
+        import pillow_avif  # noqa: F401 (support AVIF, facultatif)
+    except ImportError:
+        pass
+    return Image
 
 
 def generate_id(text):
@@ -46,20 +204,37 @@ def generate_id(text):
     return int(hashlib.sha256(text.encode()).hexdigest()[:12], 16)
 
 
-def download_image(url, folder):
-    """Télécharge une image et retourne le chemin local."""
-    if not REQUESTS_AVAILABLE:
-        return None, None
-
-    os.makedirs(folder, exist_ok=True)
+def image_filename(url):
+    """Nom d'une image dans le paquet, déduit de la fin de son URL."""
     filename = url.split("/")[-1]
     # Décoder les caractères URL (%20 -> espace) et remplacer espaces par underscores
-    from urllib.parse import unquote
     filename = unquote(filename).replace(' ', '_')
     if not any(filename.endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif']):
         filename += ".png"
+    return filename
+
+
+def cache_filename(url):
+    """
+    Nom d'une image dans le dossier de cache : empreinte de l'URL complète
+    et extension de image_filename. Deux URL finissant par le même nom de
+    fichier ne partagent pas d'entrée dans un cache commun à plusieurs maps.
+    """
+    ext = os.path.splitext(image_filename(url))[1]
+    return f"{hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]}{ext}"
+
+
+def download_image(url, folder):
+    """Télécharge une image ; retourne (chemin dans le cache, nom dans le paquet)."""
+    requests = _requests()
+    if requests is None:
+        return None, None
+
+    os.makedirs(folder, exist_ok=True)
+    filename = image_filename(url)
     
-    filepath = os.path.join(folder, filename)
+    filepath = os.path.join(folder, cache_filename(url))
+    partial_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.part"
     
     if os.path.exists(filepath):
         return filepath, filename
@@ -68,328 +243,697 @@ def download_image(url, folder):
         headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
         response = requests.get(url, timeout=15, headers=headers)
         response.raise_for_status()
-        with open(filepath, 'wb') as f:
+        # Écriture atomique : un dossier de cache partagé ne contient jamais
+        # d'image à moitié écrite
+        with open(partial_path, 'wb') as f:
             f.write(response.content)
+        os.replace(partial_path, filepath)
         return filepath, filename
     except Exception as e:
         print(f"  ⚠️ Erreur image: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
         return None, None
 
 
-def clean_text(text):
-    """Nettoie le texte et décode les entités."""
-    if not text:
-        return ""
-    
-    # D'abord, corriger l'encodage UTF-8 mal interprété
+def make_thumbnail(filepath, max_size=THUMBNAIL_SIZE):
+    """
+    Crée (ou réutilise) une miniature de l'image, à côté de l'originale :
+    JPEG progressif pour les images opaques, PNG si elles ont de la
+    transparence. Retourne son chemin, ou None si Pillow est absent, si
+    l'image est illisible ou déjà plus petite que max_size.
+    """
+    Image = _pil_image()
+    if Image is None:
+        return None
+
+    base = f"{os.path.splitext(filepath)[0]}_thumb{max_size}"
+    for ext in ('.jpg', '.png'):
+        if os.path.exists(base + ext):
+            return base + ext
+
     try:
-        # Tous les caractères français mal encodés en UTF-8 → Latin-1
-        # Vérifier si on a des séquences suspectes
-        if any(suspect in text for suspect in ['Ã', 'Å', 'Ã‚', 'Ãƒ']):
-            text = text.encode('latin-1').decode('utf-8')
+        with Image.open(filepath) as img:
+            if max(img.size) <= max_size:
+                return None
+            alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+            # Les JPEG sont décodés directement à taille réduite
+            img.draft('RGB', (max_size, max_size))
+            thumb = img.convert('RGBA' if alpha else 'RGB')
+        thumb.thumbnail((max_size, max_size))
+        path = base + ('.png' if alpha else '.jpg')
+        partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        if alpha:
+            thumb.save(partial_path, 'PNG', optimize=True)
+        else:
+            thumb.save(partial_path, 'JPEG', quality=80, optimize=True, progressive=True)
+        os.replace(partial_path, path)
+        return path
     except Exception as e:
-        # Si ça échoue, essayer une autre méthode
+        print(f"  ⚠️ Miniature impossible: {e}")
+        return None
+
+
+def _fetch_image(url, folder, thumbnail_size, catalog=None):
+    """
+    Tâche du pool de téléchargement : image, empreinte dans le catalogue
+    éventuel, puis miniature. Retourne (chemin, nom, miniature).
+    """
+    filepath, filename = download_image(url, folder)
+    if catalog is not None and filepath:
+        catalog.record_image(url, filepath)
+    thumb_path = make_thumbnail(filepath, thumbnail_size) if filepath and thumbnail_size else None
+    return filepath, filename, thumb_path
+
+
+def _build_mojibake_tables():
+    """
+    Tables pour réparer l'UTF-8 lu comme du cp1252/latin-1 ("Ã©" → "é").
+    Chaque caractère d'un segment suspect est ramené à l'octet dont il provient.
+    Le marqueur ne reconnaît que les octets de tête courants du mojibake
+    (Â, Ã, Ä, Å, Ð, Ñ, â) : "É" suivi d'une espace insécable ou de "»" est
+    du français correct, pas de l'UTF-8 mal lu.
+    """
+    to_byte = {}
+    for byte in range(0x80, 0xa0):
         try:
-            text = text.encode('cp1252').decode('utf-8')
-        except:
+            to_byte[ord(bytes([byte]).decode('cp1252'))] = chr(byte)
+        except UnicodeDecodeError:
             pass
-    
+    continuation = '\x80-\xbf' + ''.join(chr(c) for c in to_byte)
+    hint = re.compile(f'[{continuation}]')
+    pattern = re.compile(
+        f'[\xc2-\xdf][{continuation}]'
+        f'|[\xe0-\xef][{continuation}]{{2}}'
+        f'|[\xf0-\xf4][{continuation}]{{3}}'
+    )
+    marker = re.compile(f'[\xc2-\xc5\xd0\xd1][{continuation}]|\xe2[{continuation}]{{2}}')
+    return to_byte, hint, pattern, marker
+
+
+_MOJIBAKE_TO_BYTE, _MOJIBAKE_HINT, _MOJIBAKE_PATTERN, _MOJIBAKE_MARKER = _build_mojibake_tables()
+_UNICODE_ESCAPE_PATTERN = re.compile(r'\\u(d[89ab][0-9a-f]{2})\\u(d[c-f][0-9a-f]{2})|\\u([0-9a-f]{4})', re.IGNORECASE)
+_SURROGATE_ESCAPE_PATTERN = re.compile(r'\\u[dD][89abAB]')
+_TAG_PATTERN = re.compile(r'<[^>]+>')
+_SAFE_TAG_PATTERN = re.compile(r'<(/?)([A-Za-z][A-Za-z0-9]*)([^>]*)>|<[^>]*>')
+_HREF_PATTERN = re.compile(r'href\s*=\s*["\']?(https?://[^"\'\s>]+)', re.IGNORECASE)
+_ENTITY_PATTERN = re.compile(r'&(?:#\d+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);')
+
+# Balises conservées avec keep_formatting (sans leurs attributs, sauf href)
+_SAFE_TAGS = {'b', 'strong', 'i', 'em', 'u', 'br', 'a'}
+
+
+def _decode_unicode_escape(match):
+    high, low, single = match.groups()
+    if single:
+        return chr(int(single, 16))
+    return chr(0x10000 + ((int(high, 16) - 0xd800) << 10) + (int(low, 16) - 0xdc00))
+
+
+def _fix_mojibake(match):
+    segment = match.group()
+    try:
+        return segment.translate(_MOJIBAKE_TO_BYTE).encode('latin-1').decode('utf-8')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return segment
+
+
+def _decode_unicode_escapes(text):
+    """Décode les séquences \\uXXXX (paires de substitution comprises)."""
+    if not _SURROGATE_ESCAPE_PATTERN.search(text):
+        try:
+            # Le codec C ne touche qu'aux \\uXXXX, bien plus rapide qu'un re.sub
+            return text.encode('raw_unicode_escape').decode('raw_unicode_escape')
+        except UnicodeDecodeError:
+            pass
+    return _UNICODE_ESCAPE_PATTERN.sub(_decode_unicode_escape, text)
+
+
+def _fix_mojibake_text(text):
+    """Répare l'UTF-8 mal interprété : tout le texte d'un coup si possible, sinon par segment."""
+    # Un octet de continuation UTF-8 lu comme un caractère est indispensable
+    # au mojibake : ce test d'une seule classe écarte vite le texte sain.
+    # Sans marqueur franc ("Ã©", "Â«", "â€™"...), rien n'est touché, même si
+    # le texte se décode ("É…" resterait sinon "Ʌ")
+    if not _MOJIBAKE_HINT.search(text) or not _MOJIBAKE_MARKER.search(text):
+        return text
+    for encoding in ('latin-1', 'cp1252'):
+        try:
+            return text.encode(encoding).decode('utf-8')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return _MOJIBAKE_PATTERN.sub(_fix_mojibake, text)
+
+
+@lru_cache(maxsize=1024)
+def _entity_text(entity):
+    char = html.unescape(entity)
+    # Garder échappés les caractères qui redeviendraient du HTML
+    return entity if char in '<>&' else char
+
+
+def _decode_entity(match):
+    return _entity_text(match.group())
+
+
+def _keep_safe_tag(match):
+    """Conserve une balise sûre (sans ses attributs, sauf un lien http), supprime les autres."""
+    name = match.group(2)
+    if name is None:
+        return ''
+    name = name.lower()
+    if name not in _SAFE_TAGS:
+        return ''
+    if match.group(1):
+        return '' if name == 'br' else f'</{name}>'
+    if name == 'a':
+        href = _HREF_PATTERN.search(match.group(3))
+        return f'<a href="{html.escape(href.group(1))}">' if href else '<a>'
+    return f'<{name}>'
+
+
+def clean_text(text, keep_formatting=False):
+    """
+    Nettoie le texte et décode les entités.
+
+    Chaque étape (séquences \\uXXXX, UTF-8 mal interprété, balises, entités
+    HTML, espaces multiples) utilise un motif précompilé et n'est exécutée
+    que si le texte contient le caractère qui la déclenche. Avec
+    keep_formatting, les balises sûres (<b>, <i>, <u>, <br>, liens http) sont
+    conservées au lieu d'être supprimées.
+    """
+    if not text:
+        return ""
+
     # Décoder les entités unicode échappées (\u003C -> <, etc.)
-    # Utiliser une approche plus simple avec replace
-    unicode_replacements = {
-        r'\u003C': '<',
-        r'\u003E': '>',
-        r'\u003D': '=',
-        r'\u0026': '&',
-        r'\u0027': "'",
-        r'\u0022': '"',
-    }
+    if '\\u' in text:
+        text = _decode_unicode_escapes(text)
+
+    # Corriger l'encodage UTF-8 mal interprété
+    if not text.isascii():
+        text = _fix_mojibake_text(text)
+
+    # Supprimer les balises HTML (ou ne garder que les balises sûres)
+    if '<' in text:
+        if keep_formatting:
+            text = _SAFE_TAG_PATTERN.sub(_keep_safe_tag, text)
+        else:
+            text = _TAG_PATTERN.sub('', text)
+
+    # Nettoyer les espaces multiples
+    text = ' '.join(text.split())
+
+    # Décoder les entités HTML (&eacute;, &#233;, &nbsp;...)
+    if '&' in text:
+        text = _ENTITY_PATTERN.sub(_decode_entity, text)
+
+    return text
+
+
+def find_meta_list(page_content):
+    """
+    Localise le tableau metaList:[ ... ] dans le code source (format JavaScript).
+    Retourne (début, fin) ou None. Les crochets sont comptés sans copier la page.
+    """
+    idx = page_content.find('metaList:[')
+    if idx < 0:
+        return None
+
+    start = idx + len('metaList:')
+    depth = 0
+    for match in _BRACKET_PATTERN.finditer(page_content, start):
+        if match.group() == '[':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return start, match.end()
+    return start, len(page_content)
+
+
+def iter_metas_from_content(page_content, keep_formatting=False):
+    """
+    Parse les metas du tableau metaList une à une, sans matérialiser la liste.
+    Avec keep_formatting, le gras, l'italique et les liens des notes sont conservés.
+    """
+    print("🔍 Recherche du tableau metaList dans le code source...")
+
+    span = find_meta_list(page_content)
+    if not span:
+        return
+    start, end = span
+    print(f"✓ Bloc metaList trouvé ({end - start} caractères)")
+
+    # Parser chaque objet meta individuellement
+    for match in _META_PATTERN.finditer(page_content, start, end):
+        meta_id = match.group(1)
+        name = match.group(2)
+        note_raw = match.group(3)
+        images_raw = match.group(4)
+
+        # Extraire l'URL de l'image
+        img_match = _IMAGE_URL_PATTERN.search(images_raw)
+        image_url = img_match.group(1) if img_match else ""
+
+        yield {
+            'id': meta_id,
+            'rule': clean_text(name),
+            'response': clean_text(note_raw, keep_formatting),
+            'image_url': image_url
+        }
+
+
+# Options des contextes Playwright (navigateur invisible, fenêtre de bureau)
+_CONTEXT_OPTIONS = {
+    'viewport': {'width': 1920, 'height': 1080},
+    'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+}
+
+
+def new_browser_context(playwright):
+    """Lance Chromium et ouvre un contexte prêt pour load_page. Retourne (navigateur, contexte)."""
+    browser = playwright.chromium.launch(headless=True)
+    return browser, browser.new_context(**_CONTEXT_OPTIONS)
+
+
+def _read_page(page, url, on_title):
+    """Charge la map dans page, fait défiler jusqu'au bout et retourne (code source, titre)."""
+    deck_title = "LearnableMeta Deck"
+
+    page.goto(url, wait_until='networkidle', timeout=90000)
     
-    for pattern, replacement in unicode_replacements.items():
-        text = text.replace(pattern, replacement)
+    # Attendre que les metas se chargent (attendre l'élément de liste des metas)
+    print("⏳ Attente du chargement des metas...")
     
-    # Supprimer les balises HTML
-    text = re.sub(r'<[^>]+>', '', text)
+    # Attendre l'apparition des boutons de metas
+    try:
+        page.wait_for_selector('button', timeout=10000)
+        print("✓ Premiers éléments détectés")
+    except:
+        print("⚠️  Timeout en attendant les éléments")
     
-    # Nettoyer les espaces multiples
-    text = re.sub(r'\s+', ' ', text).strip()
+    # Scroll pour forcer le lazy loading
+    print("📜 Scroll pour charger toutes les metas...")
     
-    return text
+    # Scroll progressif plus lent et plus long
+    last_height = page.evaluate('document.body.scrollHeight')
+    scroll_attempts = 0
+    max_attempts = 30
+    
+    while scroll_attempts < max_attempts:
+        # Scroll vers le bas
+        page.evaluate('window.scrollBy(0, window.innerHeight)')
+        time.sleep(0.8)
+            
+        # Vérifier si on a atteint le bas
+        new_height = page.evaluate('document.body.scrollHeight')
+        current_pos = page.evaluate('window.pageYOffset + window.innerHeight')
+            
+        # Si on a atteint le bas ET que la hauteur n'a pas changé, on a tout chargé
+        if current_pos >= new_height and new_height == last_height:
+            scroll_attempts += 1
+            if scroll_attempts >= 3:  # Confirmer 3 fois qu'on est vraiment au bout
+                print(f"✓ Fin du scroll détectée après {scroll_attempts} tentatives")
+                break
+        else:
+            scroll_attempts = 0  # Reset si on détecte du nouveau contenu
+            
+        last_height = new_height
+    
+    # Scroll final jusqu'en bas
+    for _ in range(5):
+        page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
+        time.sleep(0.5)
+    
+    # Attendre le chargement final
+    time.sleep(2)
+    
+    # Retour en haut
+    page.evaluate('window.scrollTo(0, 0)')
+    time.sleep(1)
 
+    # Récupérer le titre du deck
+    try:
+        title_elem = page.query_selector('h1')
+        if title_elem:
+            deck_title = title_elem.inner_text().strip()
+            print(f"📖 Deck: {deck_title}")
+    except:
+        pass
 
-def extract_metas_from_page(url):
-    """Extrait toutes les metas via Playwright en attendant le chargement dynamique."""
-    if not PLAYWRIGHT_AVAILABLE:
-        print("❌ Playwright requis pour l'extraction")
-        return [], ""
+    if on_title:
+        on_title(deck_title)
 
-    metas = []
-    deck_title = "LearnableMeta Deck"
+    # Nouvelle méthode: extraire directement du DOM
+    # Les metas sont dans des boutons avec des div contenant le nom et la description
+    
+    # D'abord, essayer l'ancienne méthode (parsing du JavaScript)
+    page_content = page.content()
 
+    return page_content, deck_title
+
+
+def load_page(url, on_title=None, context=None):
+    """
+    Charge une map via Playwright en attendant le chargement dynamique.
+    Retourne (code source de la page, titre du deck), ou (None, "") sans
+    Playwright. on_title(titre) est appelé dès que le titre est connu.
+
+    Avec context, un contexte Playwright déjà ouvert (voir
+    new_browser_context), la page y est ouverte puis refermée au lieu de
+    lancer un navigateur : c'est ce que font les serveurs qui gardent des
+    navigateurs chauds.
+    """
     print(f"\n🌐 Chargement de la page...")
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        )
+    if context is not None:
         page = context.new_page()
-
-        page.goto(url, wait_until='networkidle', timeout=90000)
-        
-        # Attendre que les metas se chargent (attendre l'élément de liste des metas)
-        print("⏳ Attente du chargement des metas...")
-        
-        # Attendre l'apparition des boutons de metas
         try:
-            page.wait_for_selector('button', timeout=10000)
-            print("✓ Premiers éléments détectés")
-        except:
-            print("⚠️  Timeout en attendant les éléments")
-        
-        # Scroll pour forcer le lazy loading
-        print("📜 Scroll pour charger toutes les metas...")
-        
-        # Scroll progressif plus lent et plus long
-        last_height = page.evaluate('document.body.scrollHeight')
-        scroll_attempts = 0
-        max_attempts = 30
-        
-        while scroll_attempts < max_attempts:
-            # Scroll vers le bas
-            page.evaluate('window.scrollBy(0, window.innerHeight)')
-            time.sleep(0.8)
-            
-            # Vérifier si on a atteint le bas
-            new_height = page.evaluate('document.body.scrollHeight')
-            current_pos = page.evaluate('window.pageYOffset + window.innerHeight')
-            
-            # Si on a atteint le bas ET que la hauteur n'a pas changé, on a tout chargé
-            if current_pos >= new_height and new_height == last_height:
-                scroll_attempts += 1
-                if scroll_attempts >= 3:  # Confirmer 3 fois qu'on est vraiment au bout
-                    print(f"✓ Fin du scroll détectée après {scroll_attempts} tentatives")
-                    break
-            else:
-                scroll_attempts = 0  # Reset si on détecte du nouveau contenu
-            
-            last_height = new_height
-        
-        # Scroll final jusqu'en bas
-        for _ in range(5):
-            page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-            time.sleep(0.5)
-        
-        # Attendre le chargement final
-        time.sleep(2)
-        
-        # Retour en haut
-        page.evaluate('window.scrollTo(0, 0)')
-        time.sleep(1)
-
-        # Récupérer le titre du deck
+            return _read_page(page, url, on_title)
+        finally:
+            page.close()
+
+    sync_playwright = _sync_playwright()
+    if sync_playwright is None:
+        print("❌ Playwright requis pour l'extraction")
+        return None, ""
+
+    with sync_playwright() as p:
+        browser, context = new_browser_context(p)
         try:
-            title_elem = page.query_selector('h1')
-            if title_elem:
-                deck_title = title_elem.inner_text().strip()
-                print(f"📖 Deck: {deck_title}")
-        except:
-            pass
+            return _read_page(context.new_page(), url, on_title)
+        finally:
+            browser.close()
 
-        # Nouvelle méthode: extraire directement du DOM
-        # Les metas sont dans des boutons avec des div contenant le nom et la description
-        
-        # D'abord, essayer l'ancienne méthode (parsing du JavaScript)
-        page_content = page.content()
-        
-        print("🔍 Recherche du tableau metaList dans le code source...")
-        
-        # Chercher le bloc metaList:[ ... ] dans le HTML (format JavaScript)
-        js_array = ""
-        idx = page_content.find('metaList:[')
-        if idx >= 0:
-            start = idx + len('metaList:')
-            depth = 0
-            end = start
-            for i, c in enumerate(page_content[start:start+500000]):  # Augmenter la limite
-                if c == '[':
-                    depth += 1
-                elif c == ']':
-                    depth -= 1
-                    if depth == 0:
-                        end = start + i + 1
-                        break
-            js_array = page_content[start:end]
-            
-            print(f"✓ Bloc metaList trouvé ({len(js_array)} caractères)")
-
-        if js_array:
-            # Parser chaque objet meta individuellement
-            obj_pattern = re.finditer(
-                r'\{id:(\d+),name:"([^"]+)",note:"([^"]*)",images:\[([^\]]*)\],locationsCount:"(\d+)"',
-                js_array
-            )
-
-            for match in obj_pattern:
-                meta_id = match.group(1)
-                name = match.group(2)
-                note_raw = match.group(3)
-                images_raw = match.group(4)
-
-                # Extraire l'URL de l'image
-                img_match = re.search(r'"([^"]+)"', images_raw)
-                image_url = img_match.group(1) if img_match else ""
-
-                # Nettoyer la note - IMPORTANT: décoder d'abord l'encodage
-                note = note_raw
-                
-                # Corriger l'encodage UTF-8 mal interprété AVANT de nettoyer
-                try:
-                    if any(suspect in note for suspect in ['Ã', 'Å']):
-                        note = note.encode('latin-1').decode('utf-8')
-                except:
-                    pass
-                
-                # Puis nettoyer le HTML
-                note = clean_text(note)
-                
-                # Corriger aussi le nom
-                name_clean = name
-                try:
-                    if any(suspect in name_clean for suspect in ['Ã', 'Å']):
-                        name_clean = name_clean.encode('latin-1').decode('utf-8')
-                except:
-                    pass
-
-                metas.append({
-                    'rule': name_clean,
-                    'response': note,
-                    'image_url': image_url
-                })
-                
-            print(f"✓ {len(metas)} metas extraites du code source")
-
-        print(f"📋 {len(metas)} metas trouvées sur 406 attendues")
-        
-        if len(metas) < 406:
-            print(f"⚠️  Il manque {406 - len(metas)} metas - le site indique 406 au total")
-
-        # Afficher les metas trouvées
+
+def metalist_digest(page_content):
+    """
+    Empreinte stable du tableau metaList : id, nom, note et URLs des images
+    de chaque meta, hachés au fil du parsing (sans nettoyage du texte).
+    Les autres champs (nombre de lieux...) n'en font pas partie. Retourne
+    None si la page ne contient pas de metaList.
+    """
+    span = find_meta_list(page_content)
+    if not span:
+        return None
+    start, end = span
+    digest = hashlib.sha256()
+    for match in _META_PATTERN.finditer(page_content, start, end):
+        meta_id, name, note_raw, images_raw = match.group(1, 2, 3, 4)
+        images = '\x1f'.join(_IMAGE_URL_PATTERN.findall(images_raw))
+        digest.update(f"{meta_id}\x1f{name}\x1f{note_raw}\x1f{images}\x1e".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def package_digest(digest, package_format='legacy', keep_formatting=False, media_base_url=None,
+                   thumbnail_size=THUMBNAIL_SIZE):
+    """Empreinte d'un paquet : celle du metaList plus les options de construction."""
+    options = f"{package_format}:{int(keep_formatting)}:{thumbnail_size or 0}"
+    if media_base_url is not None:
+        options += f":{media_base_url}"
+    return f"{DIGEST_VERSION}:{options}:{digest}"
+
+
+def media_bundle_path(output_path, media_bundle=True):
+    """Chemin de l'archive d'images séparée : <nom>_media.zip par défaut, None si désactivée."""
+    if media_bundle is True:
+        return f"{os.path.splitext(output_path)[0]}_media.zip"
+    return media_bundle or None
+
+
+def _is_up_to_date(output_path, digest, bundle_path=None):
+    """Le paquet existant porte-t-il déjà cette empreinte (et son archive d'images existe-t-elle) ?"""
+    return (read_package_digest(output_path) == digest
+            and (bundle_path is None or os.path.exists(bundle_path)))
+
+
+def read_package_digest(path):
+    """Empreinte enregistrée dans un .apkg existant (None si absente ou fichier illisible)."""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            comment = zf.comment.decode('utf-8', 'replace')
+    except (OSError, zipfile.BadZipFile):
+        return None
+    return comment[len(_DIGEST_PREFIX):] if comment.startswith(_DIGEST_PREFIX) else None
+
+
+def extract_metas_from_page(url, on_meta=None, on_title=None, keep_formatting=False, catalog=None,
+                            on_digest=None):
+    """
+    Extrait toutes les metas via Playwright en attendant le chargement dynamique.
+
+    on_meta(meta) est appelé pour chaque meta dès qu'elle est parsée et
+    on_title(titre) dès que le titre du deck est connu, ce qui permet aux
+    étages suivants du pipeline de démarrer avant la fin de l'extraction.
+    Avec on_meta, les metas ne sont pas accumulées et la liste retournée est vide.
+    Avec catalog (un meta_catalog.Catalog), chaque meta est aussi enregistrée
+    dans le catalogue local.
+
+    on_digest(empreinte) reçoit l'empreinte du metaList (voir metalist_digest)
+    avant le parsing ; s'il retourne True, l'extraction s'arrête là (deck
+    déjà à jour) et aucune meta n'est produite.
+    """
+    page_content, deck_title = load_page(url, on_title)
+    if page_content is None:
+        return [], ""
+
+    if on_digest is not None and on_digest(metalist_digest(page_content)):
+        return [], deck_title
+
+    found = iter_metas_from_content(page_content, keep_formatting)
+    if catalog is not None:
+        found = catalog.record_map(url, deck_title, found)
+
+    metas = []
+    count = 0
+    for meta in found:
+        count += 1
+        if on_meta:
+            # En mode pipeline, les metas ne sont pas conservées en mémoire
+            on_meta(meta)
+        else:
+            metas.append(meta)
+
+    print(f"📋 {count} metas trouvées")
+
+    # Afficher les metas trouvées (en mode pipeline, la barre de
+    # progression du builder s'en charge)
+    if not on_meta:
         for i, meta in enumerate(metas):
             print(f"[{i+1}/{len(metas)}] {meta['rule']} ✓")
 
-        browser.close()
-
     return metas, deck_title
 
 
-def create_anki_package(metas, deck_name, output_path):
+def _print_progress(done, total):
+    """Affiche la barre de progression (ou un simple compteur si le total est inconnu)."""
+    if total:
+        progress = done / total * 100
+        bar_length = 40
+        filled = int(bar_length * done / total)
+        bar = '█' * filled + '░' * (bar_length - filled)
+        print(f'\r  [{bar}] {progress:.1f}% ({done}/{total})', end='', flush=True)
+    else:
+        print(f'\r  📝 {done} cartes créées', end='', flush=True)
+
+
+def _iter_sections(q):
     """
-    Crée un fichier .apkg (Anki package) à partir des metas.
-    Format .apkg = ZIP contenant collection.anki2 (SQLite) + media
+    Découpe une file de metas en sous-decks : chaque marqueur (_SECTION, titre)
+    ouvre une nouvelle map. Produit des paires (titre, itérateur de metas) qui
+    doivent être consommées dans l'ordre.
     """
-    
+    item = q.get()
+    while item is not _END:
+        title = item[1]
+        following = []
+
+        def section():
+            while True:
+                meta = q.get()
+                if meta is _END or isinstance(meta, tuple):
+                    following.append(meta)
+                    return
+                yield meta
+
+        metas = section()
+        yield title, metas
+        # Vider la section si l'appelant ne l'a pas consommée entièrement
+        for _ in metas:
+            pass
+        item = following[0]
+
+
+def _iter_queue(q):
+    """Itère sur les éléments d'une file jusqu'au marqueur de fin."""
+    while True:
+        item = q.get()
+        if item is _END:
+            return
+        yield item
+
+
+class _ConsumerGone(Exception):
+    """Le builder a abandonné la file (erreur) : le producteur doit s'arrêter."""
+
+
+def _stoppable_put(q, stop):
+    """
+    put() bloquant qui abandonne (_ConsumerGone) dès que stop est posé : sans
+    cela, un producteur dont le builder a échoué resterait bloqué sur une
+    file pleine que plus personne ne vide.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise _ConsumerGone()
+    return put
+
+
+def _varint(value):
+    """Encode un entier en varint protobuf."""
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _media_entry(filename, size, sha1):
+    """
+    Entrée MediaEntries.entries (champ 1) du manifeste media récent :
+    MediaEntry { string name = 1; uint32 size = 2; bytes sha1 = 3; }
+    """
+    name = filename.encode('utf-8')
+    entry = (b'\x0a' + _varint(len(name)) + name
+             + b'\x10' + _varint(size)
+             + b'\x1a' + _varint(len(sha1)) + sha1)
+    return b'\x0a' + _varint(len(entry)) + entry
+
+
+_zstd_local = threading.local()
+
+
+def _zstd_compress(data):
+    """Compresse en zstd (un compresseur par thread, ils ne sont pas partageables)."""
+    compressor = getattr(_zstd_local, 'compressor', None)
+    if compressor is None:
+        compressor = _zstd_local.compressor = _zstandard().ZstdCompressor()
+    return compressor.compress(data)
+
+
+def _write_legacy_stub(db_path, col_row, model_id, deck_id, now):
+    """Collection legacy minimale, affichée par les Anki trop anciens pour le format récent."""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(_COLLECTION_SCHEMA)
+    conn.execute('''
+        INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, -1, 0, ?, ?, ?, ?, '{}')
+    ''', col_row)
+    fields = f"{_LEGACY_STUB_TEXT}\x1f<div></div>\x1f<div>{_LEGACY_STUB_TEXT}</div>"
+    csum = int(hashlib.sha1(_LEGACY_STUB_TEXT.encode()).hexdigest()[:8], 16)
+    conn.execute('''
+        INSERT INTO notes VALUES (1, 'upgrade', ?, ?, -1, '', ?, ?, ?, 0, '')
+    ''', (model_id, now, fields, _LEGACY_STUB_TEXT, csum))
+    conn.execute('''
+        INSERT INTO cards VALUES (2, 1, ?, 0, ?, -1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, '')
+    ''', (deck_id, now))
+    conn.commit()
+    conn.close()
+
+
+def _deck_entry(deck_id, name, now, desc):
+    """Entrée JSON d'un deck pour la table col."""
+    return {
+        "id": deck_id,
+        "name": name,
+        "mod": now,
+        "usn": -1,
+        "lrnToday": [0, 0],
+        "revToday": [0, 0],
+        "newToday": [0, 0],
+        "timeToday": [0, 0],
+        "collapsed": False,
+        "browserCollapsed": False,
+        "desc": desc,
+        "dyn": 0,
+        "conf": 1,
+        "extendNew": 0,
+        "extendRev": 0
+    }
+
+
+def create_anki_package(metas, deck_name, output_path, workers=DOWNLOAD_WORKERS, subdecks=None,
+                        package_format='legacy', compression_levels=None, media_cache=None, digest=None,
+                        media_base_url=None, media_bundle=True, thumbnail_size=THUMBNAIL_SIZE, verify=True,
+                        catalog=None, force=False):
+    """
+    Crée un fichier .apkg (Anki package) à partir des metas (liste ou
+    itérateur alimenté au fil de l'extraction). Retourne output_path.
+
+    subdecks : paires (nom de la map, metas) ; metas est alors ignoré et
+        chaque map devient un sous-deck de deck_name
+    package_format : 'legacy' ou 'modern' (zstd, Anki 2.1.50+)
+    compression_levels : niveaux par type de membre (voir anki_zip)
+    media_cache : dossier d'images conservé d'une construction à l'autre
+    digest : empreinte (voir package_digest) enregistrée dans l'archive ;
+        rien n'est reconstruit si output_path la porte déjà, sauf avec force
+    media_base_url : images chargées depuis cette adresse au lieu d'être
+        embarquées ; media_bundle : archive d'images à publier (False : aucune)
+    thumbnail_size : côté maximal de la miniature du verso (0 : aucune)
+    verify : contrôle par anki_verifier ; ValueError si le paquet est incohérent
+    catalog : meta_catalog.Catalog où enregistrer l'empreinte des images
+    """
+    remote = media_base_url is not None
+    if remote and not media_base_url.endswith('/'):
+        media_base_url += '/'
+    bundle_path = media_bundle_path(output_path, media_bundle) if remote else None
+
+    if digest is not None and not force and _is_up_to_date(output_path, digest, bundle_path):
+        print(f"\n✅ Deck inchangé, pas de reconstruction : {output_path}")
+        return output_path
+
+    modern = package_format == 'modern'
+    if modern and _zstandard() is None:
+        print("⚠️  Format récent indisponible (pip install zstandard), format legacy utilisé")
+        modern = False
+
+    # Le paquet est écrit à côté puis renommé une fois vérifié : une
+    # construction interrompue ou refusée laisse l'ancien paquet intact
+    partial_path = f"{output_path}.part"
+    partial_bundle = f"{bundle_path}.part" if bundle_path else None
+
     # Créer un dossier temporaire
     temp_dir = tempfile.mkdtemp()
-    media_dir = os.path.join(temp_dir, 'media_files')
-    os.makedirs(media_dir, exist_ok=True)
-    
-    # IDs uniques
-    deck_id = generate_id(deck_name)
-    model_id = generate_id(f"learnable_{deck_name}")
-    
-    # Créer la base de données SQLite
-    db_path = os.path.join(temp_dir, 'collection.anki2')
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Schéma Anki 2.1
-    cursor.executescript('''
-        CREATE TABLE col (
-            id INTEGER PRIMARY KEY,
-            crt INTEGER NOT NULL,
-            mod INTEGER NOT NULL,
-            scm INTEGER NOT NULL,
-            ver INTEGER NOT NULL,
-            dty INTEGER NOT NULL,
-            usn INTEGER NOT NULL,
-            ls INTEGER NOT NULL,
-            conf TEXT NOT NULL,
-            models TEXT NOT NULL,
-            decks TEXT NOT NULL,
-            dconf TEXT NOT NULL,
-            tags TEXT NOT NULL
-        );
-        
-        CREATE TABLE notes (
-            id INTEGER PRIMARY KEY,
-            guid TEXT NOT NULL,
-            mid INTEGER NOT NULL,
-            mod INTEGER NOT NULL,
-            usn INTEGER NOT NULL,
-            tags TEXT NOT NULL,
-            flds TEXT NOT NULL,
-            sfld TEXT NOT NULL,
-            csum INTEGER NOT NULL,
-            flags INTEGER NOT NULL,
-            data TEXT NOT NULL
-        );
-        
-        CREATE TABLE cards (
-            id INTEGER PRIMARY KEY,
-            nid INTEGER NOT NULL,
-            did INTEGER NOT NULL,
-            ord INTEGER NOT NULL,
-            mod INTEGER NOT NULL,
-            usn INTEGER NOT NULL,
-            type INTEGER NOT NULL,
-            queue INTEGER NOT NULL,
-            due INTEGER NOT NULL,
-            ivl INTEGER NOT NULL,
-            factor INTEGER NOT NULL,
-            reps INTEGER NOT NULL,
-            lapses INTEGER NOT NULL,
-            left INTEGER NOT NULL,
-            odue INTEGER NOT NULL,
-            odid INTEGER NOT NULL,
-            flags INTEGER NOT NULL,
-            data TEXT NOT NULL
-        );
-        
-        CREATE TABLE revlog (
-            id INTEGER PRIMARY KEY,
-            cid INTEGER NOT NULL,
-            usn INTEGER NOT NULL,
-            ease INTEGER NOT NULL,
-            ivl INTEGER NOT NULL,
-            lastIvl INTEGER NOT NULL,
-            factor INTEGER NOT NULL,
-            time INTEGER NOT NULL,
-            type INTEGER NOT NULL
-        );
-        
-        CREATE TABLE graves (
-            usn INTEGER NOT NULL,
-            oid INTEGER NOT NULL,
-            type INTEGER NOT NULL
-        );
-        
-        CREATE INDEX ix_notes_csum ON notes (csum);
-        CREATE INDEX ix_notes_usn ON notes (usn);
-        CREATE INDEX ix_cards_nid ON cards (nid);
-        CREATE INDEX ix_cards_sched ON cards (did, queue, due);
-        CREATE INDEX ix_cards_usn ON cards (usn);
-        CREATE INDEX ix_revlog_cid ON revlog (cid);
-        CREATE INDEX ix_revlog_usn ON revlog (usn);
-    ''')
-    
-    # Timestamp actuel
-    now = int(time.time())
-    now_ms = now * 1000
-    
-    # CSS pour les cartes
-    card_css = '''.card {
+    try:
+        media_dir = media_cache or os.path.join(temp_dir, 'media_files')
+        os.makedirs(media_dir, exist_ok=True)
+
+        # IDs uniques
+        deck_id = generate_id(deck_name)
+        model_id = generate_id(f"learnable_{deck_name}")
+
+        # Créer la base de données SQLite
+        db_path = os.path.join(temp_dir, 'collection.anki2')
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        # Schéma Anki 2.1
+        cursor.executescript(_COLLECTION_SCHEMA)
+
+        # Timestamp actuel
+        now = int(time.time())
+        now_ms = now * 1000
+
+        # CSS pour les cartes
+        card_css = '''.card {
     font-family: Arial, sans-serif;
     font-size: 18px;
     text-align: center;
@@ -424,219 +968,556 @@ hr {
     background-color: #ddd;
     margin: 15px 0;
 }'''
-    
-    # Modèle de carte
-    model = {
-        str(model_id): {
-            "id": model_id,
-            "name": "Learnable",
-            "type": 0,
-            "mod": now,
-            "usn": -1,
-            "sortf": 0,
-            "did": deck_id,
-            "tmpls": [{
-                "name": "Card 1",
-                "ord": 0,
-                "qfmt": '<div class="question">{{Question}}</div>',
-                "afmt": '{{Response}}',
-                "bqfmt": "",
-                "bafmt": "",
-                "did": None,
-                "bfont": "",
-                "bsize": 0
-            }],
-            "flds": [
-                {"name": "Rule", "ord": 0, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []},
-                {"name": "Question", "ord": 1, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []},
-                {"name": "Response", "ord": 2, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
-            ],
-            "css": card_css,
-            "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
-            "latexPost": "\\end{document}",
-            "latexsvg": False,
-            "req": [[0, "any", [0, 1]]]
+
+        # Modèle de carte
+        model = {
+            str(model_id): {
+                "id": model_id,
+                "name": "Learnable",
+                "type": 0,
+                "mod": now,
+                "usn": -1,
+                "sortf": 0,
+                "did": deck_id,
+                "tmpls": [{
+                    "name": "Card 1",
+                    "ord": 0,
+                    "qfmt": '<div class="question">{{Question}}</div>',
+                    "afmt": '{{Response}}',
+                    "bqfmt": "",
+                    "bafmt": "",
+                    "did": None,
+                    "bfont": "",
+                    "bsize": 0
+                }],
+                "flds": [
+                    {"name": "Rule", "ord": 0, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []},
+                    {"name": "Question", "ord": 1, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []},
+                    {"name": "Response", "ord": 2, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+                ],
+                "css": card_css,
+                "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+                "latexPost": "\\end{document}",
+                "latexsvg": False,
+                "req": [[0, "any", [0, 1]]]
+            }
         }
-    }
-    
-    # Deck
-    decks = {
-        str(deck_id): {
-            "id": deck_id,
-            "name": deck_name,
-            "mod": now,
-            "usn": -1,
-            "lrnToday": [0, 0],
-            "revToday": [0, 0],
-            "newToday": [0, 0],
-            "timeToday": [0, 0],
-            "collapsed": False,
-            "browserCollapsed": False,
-            "desc": f"Deck généré depuis LearnableMeta",
-            "dyn": 0,
-            "conf": 1,
-            "extendNew": 0,
-            "extendRev": 0
-        },
-        "1": {
-            "id": 1,
-            "name": "Default",
-            "mod": now,
-            "usn": -1,
-            "lrnToday": [0, 0],
-            "revToday": [0, 0],
-            "newToday": [0, 0],
-            "timeToday": [0, 0],
-            "collapsed": False,
-            "browserCollapsed": False,
-            "desc": "",
-            "dyn": 0,
-            "conf": 1,
-            "extendNew": 0,
-            "extendRev": 0
+
+        # Decks (le deck parent, puis un sous-deck par map en mode combiné)
+        decks = {
+            str(deck_id): _deck_entry(deck_id, deck_name, now, "Deck généré depuis LearnableMeta"),
+            "1": _deck_entry(1, "Default", now, "")
         }
-    }
-    
-    # Configuration du deck
-    dconf = {
-        "1": {
-            "id": 1,
-            "name": "Default",
-            "mod": 0,
-            "usn": 0,
-            "maxTaken": 60,
-            "autoplay": True,
-            "timer": 0,
-            "replayq": True,
-            "new": {"bury": False, "delays": [1, 10], "initialFactor": 2500, "ints": [1, 4, 0], "order": 1, "perDay": 20},
-            "rev": {"bury": False, "ease4": 1.3, "ivlFct": 1, "maxIvl": 36500, "perDay": 200, "hardFactor": 1.2},
-            "lapse": {"delays": [10], "leechAction": 1, "leechFails": 8, "minInt": 1, "mult": 0}
+
+        # Configuration du deck
+        dconf = {
+            "1": {
+                "id": 1,
+                "name": "Default",
+                "mod": 0,
+                "usn": 0,
+                "maxTaken": 60,
+                "autoplay": True,
+                "timer": 0,
+                "replayq": True,
+                "new": {"bury": False, "delays": [1, 10], "initialFactor": 2500, "ints": [1, 4, 0], "order": 1, "perDay": 20},
+                "rev": {"bury": False, "ease4": 1.3, "ivlFct": 1, "maxIvl": 36500, "perDay": 200, "hardFactor": 1.2},
+                "lapse": {"delays": [10], "leechAction": 1, "leechFails": 8, "minInt": 1, "mult": 0}
+            }
         }
-    }
-    
-    conf = {
-        "activeDecks": [1],
-        "curDeck": deck_id,
-        "newSpread": 0,
-        "collapseTime": 1200,
-        "timeLim": 0,
-        "estTimes": True,
-        "dueCounts": True,
-        "curModel": str(model_id),
-        "nextPos": 1,
-        "sortType": "noteFld",
-        "sortBackwards": False,
-        "addToCur": True
-    }
-    
-    # Insérer les métadonnées
-    cursor.execute('''
-        INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, -1, 0, ?, ?, ?, ?, '{}')
-    ''', (now, now, now_ms, json.dumps(conf), json.dumps(model), json.dumps(decks), json.dumps(dconf)))
-    
-    # Créer les notes et cartes
-    media_map = {}
-    media_index = 0
-    
-    print(f"\n📝 Création de {len(metas)} cartes...")
-    
-    for i, meta in enumerate(metas):
-        # Afficher la progression
-        progress = (i + 1) / len(metas) * 100
-        bar_length = 40
-        filled = int(bar_length * (i + 1) / len(metas))
-        bar = '█' * filled + '░' * (bar_length - filled)
-        print(f'\r  [{bar}] {progress:.1f}% ({i + 1}/{len(metas)})', end='', flush=True)
-        
-        note_id = now_ms + i
-        card_id = now_ms + 1000000 + i
-        guid = hashlib.md5(f"{deck_name}_{meta['rule']}_{i}".encode()).hexdigest()[:10]
-        
-        # Préparer les champs image (deux copies distinctes)
-        question_image = ""
-        response_image = ""
-        if meta['image_url']:
-            filepath, filename = download_image(meta['image_url'], media_dir)
-            if filepath and os.path.exists(filepath):
-                # Image pour Question
+
+        conf = {
+            "activeDecks": [1],
+            "curDeck": deck_id,
+            "newSpread": 0,
+            "collapseTime": 1200,
+            "timeLim": 0,
+            "estTimes": True,
+            "dueCounts": True,
+            "curModel": str(model_id),
+            "nextPos": 1,
+            "sortType": "noteFld",
+            "sortBackwards": False,
+            "addToCur": True
+        }
+
+        # Créer les notes et cartes
+        # Les téléchargements tournent dans un pool de threads pendant que les
+        # notes déjà prêtes sont insérées dans la base et leurs images écrites
+        # dans l'archive : réseau, CPU et disque se recouvrent.
+        # Mémoire bornée quelle que soit la taille du deck : le fichier media est
+        # écrit au fil de l'eau et l'index des images déjà embarquées (une image
+        # partagée par plusieurs maps ne l'est qu'une fois) vit dans une base
+        # SQLite temporaire plutôt qu'en mémoire.
+        media_index = 0
+        media_json_path = os.path.join(temp_dir, 'media')
+        if modern:
+            # Manifeste protobuf : les entrées répétées s'écrivent bout à bout
+            media_file = open(media_json_path, 'wb')
+        else:
+            media_file = open(media_json_path, 'w')
+            media_file.write('{')
+        written = sqlite3.connect(os.path.join(temp_dir, 'written.db'))
+        written.execute('CREATE TABLE written (filename TEXT PRIMARY KEY, name_q TEXT, name_r TEXT)')
+        written.execute('CREATE INDEX written_q ON written (name_q)')
+        if subdecks is None:
+            subdecks = [(None, metas)]
+            total = len(metas) if hasattr(metas, '__len__') else None
+        else:
+            total = None
+        count = 0
+        last_progress = 0
+        window = workers * 4
+        pending = deque()
+        downloads = {}
+        failed = []
+
+        if total is not None:
+            print(f"\n📝 Création de {total} cartes...")
+        else:
+            print(f"\n📝 Création des cartes au fil de l'extraction...")
+
+        def add_media(filepath, filename):
+            nonlocal media_index
+            name = str(media_index)
+            if modern:
+                with open(filepath, 'rb') as f:
+                    data = f.read()
+                media_file.write(_media_entry(filename, len(data), hashlib.sha1(data).digest()))
+                zf.writestr(name, data, 'stored', transform=_zstd_compress)
+            else:
+                media_file.write(f"{', ' if media_index else ''}{json.dumps(name)}: {json.dumps(filename)}")
+                zf.write(filepath, name, 'image')
+            media_index += 1
+
+        def remote_images(url, download):
+            # Références vers le serveur d'images, sous leur nom dans le cache
+            # (unique par URL, celui que sert learnablemeta_server) ; l'image
+            # téléchargée et sa miniature vont dans l'archive séparée (une
+            # seule fois)
+            if not url:
+                return "", ""
+            filename = filename_r = cache_filename(url)
+            if bundle is not None:
+                filepath, _, thumb_path = download.result()
+                if not filepath or not os.path.exists(filepath):
+                    return "", ""
+                known = written.execute('SELECT name_r FROM written WHERE filename = ?', (filename,)).fetchone()
+                if known:
+                    filename_r, = known
+                else:
+                    bundle.write(filepath, filename, 'image')
+                    if thumb_path:
+                        filename_r = os.path.basename(thumb_path)
+                        bundle.write(thumb_path, filename_r, 'image')
+                    written.execute('INSERT INTO written VALUES (?, ?, ?)', (filename, filename, filename_r))
+            return (f'<img src="{media_base_url}{quote(filename)}">',
+                    f'<img src="{media_base_url}{quote(filename_r)}">')
+
+        def insert_note(i, meta, download, did):
+            # IDs entrelacés : notes paires, cartes impaires, sans collision
+            # quelle que soit la taille du deck
+            note_id = now_ms + 2 * i
+            card_id = now_ms + 2 * i + 1
+            guid = hashlib.md5(f"{deck_name}_{meta['rule']}_{i}".encode()).hexdigest()[:10]
+
+            # Préparer les champs image (l'image complète au recto, sa miniature
+            # ou une copie distincte au verso)
+            question_image = ""
+            response_image = ""
+            filepath, filename, thumb_path = download.result() if download and not remote else (None, None, None)
+            if remote:
+                question_image, response_image = remote_images(meta['image_url'], download)
+            # Les images sont repérées par leur nom dans le cache (unique par URL)
+            key = filepath and os.path.basename(filepath)
+            known = filepath and written.execute(
+                'SELECT name_q, name_r FROM written WHERE filename = ?', (key,)
+            ).fetchone()
+            if known:
+                filename_q, filename_r = known
+                question_image = f'<img src="{filename_q}">'
+                response_image = f'<img src="{filename_r}">'
+            elif filepath and os.path.exists(filepath):
+                # Image pour Question (nom lisible, déduit de l'URL ; suffixé
+                # si une autre image du paquet porte déjà le même)
                 name_base, ext = os.path.splitext(filename)
+                if written.execute('SELECT 1 FROM written WHERE name_q = ?', (f"{name_base}_q{ext}",)).fetchone():
+                    name_base = f"{name_base}_{os.path.splitext(key)[0][:8]}"
                 filename_q = f"{name_base}_q{ext}"
-                new_name_q = str(media_index)
-                media_map[new_name_q] = filename_q
-                shutil.copy(filepath, os.path.join(temp_dir, new_name_q))
+                add_media(filepath, filename_q)
                 question_image = f'<img src="{filename_q}">'
-                media_index += 1
 
-                # Image pour Response (copie distincte)
-                filename_r = f"{name_base}_r{ext}"
-                new_name_r = str(media_index)
-                media_map[new_name_r] = filename_r
-                shutil.copy(filepath, os.path.join(temp_dir, new_name_r))
+                # Image pour Response : miniature, moins coûteuse à décoder au
+                # verso (surtout sur mobile), sinon copie distincte
+                if thumb_path:
+                    filename_r = f"{name_base}_r{os.path.splitext(thumb_path)[1]}"
+                    add_media(thumb_path, filename_r)
+                else:
+                    filename_r = f"{name_base}_r{ext}"
+                    add_media(filepath, filename_r)
                 response_image = f'<img src="{filename_r}">'
-                media_index += 1
-
-        # Champs séparés par \x1f (séparateur Anki)
-        question_field = f"<div>{question_image}</div>" if question_image else "<div></div>"
-        response_field = f"<div><b>{meta['rule']}</b><br><br>{response_image}<br><br><p style=\"text-align: justify;\">{meta['response']}</p></div>"
-        fields = f"{meta['rule']}\x1f{question_field}\x1f{response_field}"
-        
-        # Checksum
-        csum = int(hashlib.sha1(meta['rule'].encode()).hexdigest()[:8], 16)
-        
-        # Insérer la note
-        cursor.execute('''
-            INSERT INTO notes VALUES (?, ?, ?, ?, -1, '', ?, ?, ?, 0, '')
-        ''', (note_id, guid, model_id, now, fields, meta['rule'], csum))
-        
-        # Insérer la carte
-        cursor.execute('''
-            INSERT INTO cards VALUES (?, ?, ?, 0, ?, -1, 0, 0, ?, 0, 0, 0, 0, 0, 0, 0, 0, '')
-        ''', (card_id, note_id, deck_id, now, i))
-    
-    # Aller à la ligne après la barre de progression
-    print()
-    
-    conn.commit()
-    conn.close()
-    
-    # Créer le fichier media
-    media_json_path = os.path.join(temp_dir, 'media')
-    with open(media_json_path, 'w') as f:
-        json.dump(media_map, f)
-    
-    # Créer l'archive ZIP
-    print(f"\n📦 Création du fichier {output_path}...")
-    print("  [████████████████████████████████████████] Compression...", end='', flush=True)
-    
-    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-        zf.write(db_path, 'collection.anki2')
-        zf.write(media_json_path, 'media')
-        
-        for idx in media_map.keys():
-            media_file = os.path.join(temp_dir, idx)
-            if os.path.exists(media_file):
-                zf.write(media_file, idx)
-    
-    print(" ✓")  # Marquer la compression comme terminée
-    
-    # Nettoyage
-    shutil.rmtree(temp_dir)
-    
+
+                written.execute('INSERT INTO written VALUES (?, ?, ?)', (key, filename_q, filename_r))
+
+            # Champs séparés par \x1f (séparateur Anki)
+            question_field = f"<div>{question_image}</div>" if question_image else "<div></div>"
+            response_field = f"<div><b>{meta['rule']}</b><br><br>{response_image}<br><br><p style=\"text-align: justify;\">{meta['response']}</p></div>"
+            fields = f"{meta['rule']}\x1f{question_field}\x1f{response_field}"
+            if meta['image_url'] and not question_image:
+                failed.append(meta['image_url'])
+
+            # Checksum
+            csum = int(hashlib.sha1(meta['rule'].encode()).hexdigest()[:8], 16)
+
+            # Insérer la note
+            cursor.execute('''
+                INSERT INTO notes VALUES (?, ?, ?, ?, -1, '', ?, ?, ?, 0, '')
+            ''', (note_id, guid, model_id, now, fields, meta['rule'], csum))
+
+            # Insérer la carte
+            cursor.execute('''
+                INSERT INTO cards VALUES (?, ?, ?, 0, ?, -1, 0, 0, ?, 0, 0, 0, 0, 0, 0, 0, 0, '')
+            ''', (card_id, note_id, did, now, i))
+
+        def flush(limit):
+            # Insérer dans l'ordre les notes dont l'image est prête (ou toutes
+            # celles au-delà de la fenêtre, en attendant leur téléchargement)
+            nonlocal count, last_progress
+            while pending and (len(pending) > limit or pending[0][2] is None or pending[0][2].done()):
+                i, meta, download, did = pending.popleft()
+                insert_note(i, meta, download, did)
+                count += 1
+                if time.monotonic() - last_progress >= 0.1:
+                    _print_progress(count, total)
+                    last_progress = time.monotonic()
+
+        bundle_writer = ParallelZipWriter(partial_bundle, compression_levels) if bundle_path else contextlib.nullcontext()
+        with ThreadPoolExecutor(max_workers=workers) as pool, \
+                ParallelZipWriter(partial_path, compression_levels) as zf, \
+                bundle_writer as bundle:
+            i = 0
+            for subdeck_name, section in subdecks:
+                did = deck_id
+                if subdeck_name is not None:
+                    full_name = f"{deck_name}::{subdeck_name}"
+                    did = generate_id(full_name)
+                    decks.setdefault(str(did), _deck_entry(did, full_name, now, "Map LearnableMeta"))
+
+                for meta in section:
+                    download = None
+                    url = meta['image_url']
+                    if url and (bundle is not None or not remote):
+                        # Une même image n'est téléchargée qu'une seule fois tant
+                        # qu'elle est dans la fenêtre ; au-delà, le cache disque
+                        # de download_image prend le relais
+                        download = downloads.get(url)
+                        if download is None:
+                            download = pool.submit(_fetch_image, url, media_dir, thumbnail_size, catalog)
+                            downloads[url] = download
+                    pending.append((i, meta, download, did))
+                    flush(window)
+                    if len(downloads) > window:
+                        downloads = {u: d for u, d in downloads.items() if not d.done()}
+                    i += 1
+            flush(0)
+            _print_progress(count, total)
+
+            # Aller à la ligne après la barre de progression
+            print()
+
+            # Insérer les métadonnées (une fois tous les sous-decks connus)
+            col_row = (now, now, now_ms, json.dumps(conf), json.dumps(model), json.dumps(decks), json.dumps(dconf))
+            cursor.execute('''
+                INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, -1, 0, ?, ?, ?, ?, '{}')
+            ''', col_row)
+
+            conn.commit()
+            conn.close()
+
+            # Terminer le fichier media
+            if not modern:
+                media_file.write('}')
+            media_file.close()
+            written.close()
+
+            # Finaliser l'archive ZIP (les images y sont déjà)
+            print(f"\n📦 Création du fichier {output_path}...")
+            print("  [████████████████████████████████████████] Compression...", end='', flush=True)
+
+            if modern:
+                stub_path = os.path.join(temp_dir, 'stub.anki2')
+                _write_legacy_stub(stub_path, col_row, model_id, deck_id, now)
+                zf.write(stub_path, 'collection.anki2', 'collection')
+                # zstd compresse lui-même sur tous les cœurs
+                compressor = _zstandard().ZstdCompressor(threads=-1)
+                for path, name in ((db_path, 'collection.anki21b'), (media_json_path, 'media')):
+                    with open(path, 'rb') as src, open(f"{path}.zst", 'wb') as dst:
+                        compressor.copy_stream(src, dst)
+                    zf.write(f"{path}.zst", name, 'stored')
+                zf.writestr('meta', _PACKAGE_META_LATEST, 'stored')
+            else:
+                zf.write(db_path, 'collection.anki2', 'collection')
+                zf.write(media_json_path, 'media', 'media')
+
+            # Paquet incomplet (images manquantes) : pas d'empreinte, pour que
+            # la prochaine construction réessaie au lieu de le croire à jour
+            if digest is not None and not failed:
+                zf.comment = f"{_DIGEST_PREFIX}{digest}".encode('utf-8')
+
+        print(" ✓")  # Marquer la compression comme terminée
+
+        if verify:
+            report = verify_apkg(partial_path, media_base_url=media_base_url)
+            print()
+            print_report(report)
+            if not report['ok']:
+                # Un paquet incohérent ne doit ni être importé ni passer pour à jour
+                raise ValueError(f"Paquet incohérent, non enregistré : {output_path}")
+
+        if partial_bundle:
+            os.replace(partial_bundle, bundle_path)
+        os.replace(partial_path, output_path)
+    finally:
+        # Nettoyage (aussi en cas d'erreur ou d'interruption)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        for path in (partial_path, partial_bundle):
+            if path and os.path.exists(path):
+                os.remove(path)
+
     print(f"\n✅ Deck créé avec succès!")
     print(f"   📁 Fichier: {output_path}")
-    print(f"   📊 Cartes: {len(metas)}")
-    print(f"   🖼️  Images: {len(media_map)}")
+    print(f"   📊 Cartes: {count}")
+    print(f"   🖼️  Images: {media_index}")
+    if failed:
+        print(f"   ⚠️  Images non téléchargées: {len(failed)}")
+        for url in failed[:5]:
+            print(f"      - {url}")
+        if len(failed) > 5:
+            print(f"      ... et {len(failed) - 5} autres")
+    if remote:
+        print(f"   🌐 Images chargées depuis: {media_base_url}")
+        if bundle_path:
+            print(f"   🗜️  Archive d'images à publier: {bundle_path}")
     print(f"\n💡 Pour importer dans Anki: Fichier > Importer > {output_path}")
-    
+
+    return output_path
+
+
+def extract(url, keep_formatting=False, catalog=None):
+    """API publique : extrait les metas d'une map. Retourne (metas, titre du deck)."""
+    return extract_metas_from_page(url, keep_formatting=keep_formatting, catalog=catalog)
+
+
+def build_apkg(metas, deck_name, output_path, **options):
+    """
+    API publique : construit un .apkg à partir de metas (liste ou itérateur),
+    ou de plusieurs maps en sous-decks avec subdecks=[(nom, metas), ...].
+    Les options sont celles de create_anki_package.
+    """
+    return create_anki_package(metas, deck_name, output_path, **options)
+
+
+def output_filename(url, deck_title):
+    """Nom du fichier .apkg de sortie pour une map."""
+    map_id = url.split('/')[-1][:12]
+    safe_title = re.sub(r'[^\w\s-]', '', deck_title).strip()[:30]
+    output_file = f"{safe_title}_{map_id}.apkg" if safe_title else f"learnablemeta_{map_id}.apkg"
+    return output_file.replace(' ', '_')
+
+
+def build_from_url(url, output_path=None, workers=DOWNLOAD_WORKERS, keep_formatting=False,
+                   package_format='legacy', catalog=None, force=False, media_base_url=None, media_bundle=True,
+                   thumbnail_size=THUMBNAIL_SIZE, verify=True):
+    """
+    Pipeline extraction → téléchargement → construction.
+
+    L'extraction tourne dans un thread producteur qui pousse chaque meta dans
+    une file ; le builder la consomme au fil de l'eau. Retourne le chemin du
+    .apkg créé, ou None si aucune meta n'a été trouvée.
+
+    Si le .apkg existe déjà avec la même empreinte (voir metalist_digest),
+    la map n'est pas reconstruite : seule la page a été chargée. force
+    désactive cette vérification. media_base_url, media_bundle,
+    thumbnail_size et verify : voir create_anki_package.
+    """
+    meta_queue = queue.Queue(maxsize=workers * 16)
+    stop = threading.Event()
+    put = _stoppable_put(meta_queue, stop)
+    title_ready = threading.Event()
+    state = {'title': None, 'error': None, 'digest': None, 'unchanged': False}
+
+    def on_title(title):
+        state['title'] = title
+        title_ready.set()
+
+    def on_digest(digest):
+        if digest is None:
+            return False
+        state['digest'] = package_digest(digest, package_format, keep_formatting, media_base_url,
+                                         thumbnail_size)
+        path = output_path or output_filename(url, state['title'] or "LearnableMeta Deck")
+        bundle_path = media_bundle_path(path, media_bundle) if media_base_url is not None else None
+        state['unchanged'] = not force and _is_up_to_date(path, state['digest'], bundle_path)
+        return state['unchanged']
+
+    def producer():
+        try:
+            extract_metas_from_page(url, on_meta=put, on_title=on_title,
+                                    keep_formatting=keep_formatting, catalog=catalog, on_digest=on_digest)
+        except Exception as e:
+            state['error'] = e
+        finally:
+            title_ready.set()
+            try:
+                put(_END)
+            except _ConsumerGone:
+                pass
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        # Le nom du deck (et donc du fichier) est connu avant les metas
+        title_ready.wait()
+        metas = _iter_queue(meta_queue)
+        first = next(metas, None)
+        deck_title = state['title'] or "LearnableMeta Deck"
+        output_path = output_path or output_filename(url, deck_title)
+        if first is None:
+            thread.join()
+            if state['error']:
+                raise state['error']
+            if state['unchanged']:
+                print(f"\n✅ Map inchangée depuis la dernière construction : {output_path}")
+                return output_path
+            return None
+
+        def chained():
+            yield first
+            yield from metas
+            if state['error']:
+                # Extraction interrompue : le paquet partiel n'est pas
+                # enregistré, l'ancien reste en place
+                raise state['error']
+
+        # Empreinte connue avant la première meta (calculée juste après le chargement)
+        create_anki_package(chained(), deck_title, output_path, workers, package_format=package_format,
+                            digest=state['digest'], force=force, media_base_url=media_base_url, media_bundle=media_bundle,
+                            thumbnail_size=thumbnail_size, verify=verify, catalog=catalog)
+        thread.join()
+        return output_path
+    finally:
+        # Arrête le producteur si le builder a échoué (sans effet sinon)
+        stop.set()
+
+
+def build_from_urls(urls, deck_name, output_path, workers=DOWNLOAD_WORKERS, keep_formatting=False,
+                    package_format='legacy', catalog=None, media_base_url=None, media_bundle=True,
+                    thumbnail_size=THUMBNAIL_SIZE, verify=True):
+    """
+    Construit un seul .apkg regroupant plusieurs maps, chacune en sous-deck de
+    deck_name. Les maps sont extraites l'une après l'autre dans le thread
+    producteur pendant que le builder consomme les précédentes. Retourne le
+    chemin du .apkg créé, ou None si aucune meta n'a été trouvée.
+    """
+    meta_queue = queue.Queue(maxsize=workers * 16)
+    stop = threading.Event()
+    put = _stoppable_put(meta_queue, stop)
+    state = {'error': None, 'seen': 0, 'section': None}
+
+    def on_title(title):
+        state['section'] = title
+
+    def on_meta(meta):
+        # Le sous-deck n'est ouvert qu'à la première meta de la map : une map
+        # vide ne laisse pas de sous-deck vide
+        if state['section'] is not None:
+            put((_SECTION, state['section']))
+            state['section'] = None
+        state['seen'] += 1
+        put(meta)
+
+    def producer():
+        try:
+            for url in urls:
+                state['section'] = url
+                extract_metas_from_page(
+                    url,
+                    on_meta=on_meta,
+                    on_title=on_title,
+                    keep_formatting=keep_formatting,
+                    catalog=catalog
+                )
+        except Exception as e:
+            state['error'] = e
+        finally:
+            try:
+                put(_END)
+            except _ConsumerGone:
+                pass
+
+    def sections():
+        yield from _iter_sections(meta_queue)
+        if state['error']:
+            # Extraction interrompue : le paquet partiel n'est pas enregistré
+            raise state['error']
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        create_anki_package(None, deck_name, output_path, workers, subdecks=sections(),
+                            package_format=package_format, media_base_url=media_base_url,
+                            media_bundle=media_bundle, thumbnail_size=thumbnail_size, verify=verify,
+                            catalog=catalog)
+    finally:
+        # Arrête le producteur si le builder a échoué (sans effet sinon)
+        stop.set()
+    thread.join()
+    if not state['seen']:
+        os.remove(output_path)
+        bundle_path = media_bundle_path(output_path, media_bundle) if media_base_url is not None else None
+        if bundle_path and os.path.exists(bundle_path):
+            os.remove(bundle_path)
+        return None
     return output_path
 
 
-def main():
+def main(argv=None, confirm=input):
+    parser = argparse.ArgumentParser(
+        description="Convertit une map LearnableMeta en deck Anki (.apkg).",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Exemple: python learnablemeta_to_anki.py https://learnablemeta.com/maps/68d3d5bfbb462cc5f7bb6945",
+    )
+    parser.add_argument('urls', nargs='*', metavar='url',
+                        help="URL de la map LearnableMeta (plusieurs URLs = un seul deck avec sous-decks)")
+    parser.add_argument('-o', '--output', help="Fichier .apkg de sortie (défaut: <titre>_<id>.apkg)")
+    parser.add_argument('--deck-name', default="LearnableMeta",
+                        help="Nom du deck parent quand plusieurs maps sont combinées (défaut: LearnableMeta)")
+    parser.add_argument('--keep-formatting', action='store_true',
+                        help="Conserver le gras, l'italique et les liens des descriptions")
+    parser.add_argument('--format', choices=['legacy', 'modern'], default='legacy',
+                        help="Format du paquet : legacy (toutes versions d'Anki) ou modern "
+                             "(Anki 2.1.50+, zstd, nécessite zstandard)")
+    parser.add_argument('--catalog', metavar='FICHIER',
+                        help="Enregistrer aussi les metas dans ce catalogue local (voir meta_catalog.py)")
+    parser.add_argument('--media-base-url', metavar='URL',
+                        help="Ne pas embarquer les images : les cartes les chargent depuis cette adresse "
+                             "(les images sont écrites dans <nom>_media.zip, à publier à cette adresse)")
+    parser.add_argument('--no-media-bundle', action='store_true',
+                        help="Avec --media-base-url, ne pas télécharger les images (déjà publiées)")
+    parser.add_argument('--thumbnail-size', type=int, default=THUMBNAIL_SIZE, metavar='PX',
+                        help=f"Taille des miniatures du verso (défaut: {THUMBNAIL_SIZE}, 0 = image complète)")
+    parser.add_argument('--no-verify', action='store_true',
+                        help="Ne pas vérifier le paquet produit (voir anki_verifier.py)")
+    parser.add_argument('--force', action='store_true',
+                        help="Reconstruire même si la map n'a pas changé depuis le dernier .apkg")
+    parser.add_argument('-y', '--yes', action='store_true', help="Ne pas demander de confirmation")
+    args = parser.parse_args(argv)
+
     print("=" * 60)
     print("  LearnableMeta → Anki Deck Converter")
     print("=" * 60)
     
-    if len(sys.argv) < 2:
+    if not args.urls:
         print(__doc__)
         print("\n❌ URL manquante!")
         print("\nUsage:")
@@ -645,37 +1526,53 @@ def main():
         print("  python learnablemeta_to_anki.py https://learnablemeta.com/maps/68d3d5bfbb462cc5f7bb6945")
         sys.exit(1)
     
-    url = sys.argv[1]
-    
-    if not PLAYWRIGHT_AVAILABLE:
+    if _sync_playwright() is None:
         print("\n❌ Playwright n'est pas installé!")
         print("\nInstallez-le avec ces commandes:")
         print("  pip install playwright requests")
         print("  playwright install chromium")
         sys.exit(1)
     
-    # Valider l'URL
-    if 'learnablemeta.com' not in url:
+    # Valider les URLs
+    if any('learnablemeta.com' not in url for url in args.urls) and not args.yes:
         print("\n⚠️  Attention: Cette URL ne semble pas être de learnablemeta.com")
-        response = input("Continuer quand même? (o/n): ")
+        response = confirm("Continuer quand même? (o/n): ")
         if response.lower() != 'o':
             sys.exit(0)
     
-    # Extraire les metas
-    metas, deck_title = extract_metas_from_page(url)
-    
-    if not metas:
+    catalog = None
+    if args.catalog:
+        from meta_catalog import Catalog
+        catalog = Catalog(args.catalog)
+
+    # Extraire, télécharger et construire en pipeline
+    try:
+        if len(args.urls) == 1:
+            output_file = build_from_url(args.urls[0], args.output, keep_formatting=args.keep_formatting,
+                                         package_format=args.format, catalog=catalog, force=args.force,
+                                         media_base_url=args.media_base_url,
+                                         media_bundle=not args.no_media_bundle,
+                                         thumbnail_size=args.thumbnail_size,
+                                         verify=not args.no_verify)
+        else:
+            safe_name = re.sub(r'[^\w\s-]', '', args.deck_name).strip().replace(' ', '_')
+            output_file = args.output or f"{safe_name or 'learnablemeta'}_combined.apkg"
+            output_file = build_from_urls(args.urls, args.deck_name, output_file,
+                                          keep_formatting=args.keep_formatting, package_format=args.format,
+                                          catalog=catalog, media_base_url=args.media_base_url,
+                                          media_bundle=not args.no_media_bundle,
+                                          thumbnail_size=args.thumbnail_size,
+                                          verify=not args.no_verify)
+    except ValueError as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+    if not output_file:
         print("\n❌ Aucune meta trouvée!")
         sys.exit(1)
-    
-    # Nom du fichier de sortie
-    map_id = url.split('/')[-1][:12]
-    safe_title = re.sub(r'[^\w\s-]', '', deck_title).strip()[:30]
-    output_file = f"{safe_title}_{map_id}.apkg" if safe_title else f"learnablemeta_{map_id}.apkg"
-    output_file = output_file.replace(' ', '_')
-    
-    # Créer le deck
-    create_anki_package(metas, deck_title, output_file)
 
 
 if __name__ == "__main__":
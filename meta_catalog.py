@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Catalogue local des metas LearnableMeta
+=======================================
+Base SQLite qui conserve toutes les metas extraites (map, id de la meta,
+règle, note, image) avec un index plein texte FTS5 sur la règle et la note.
+Elle permet de retrouver quelles maps parlent de quoi sans rien
+retélécharger, et de construire des decks directement à partir d'une
+recherche : sous-ensemble filtré d'une map ou fusion de plusieurs maps.
+
+UTILISATION:
+    python meta_catalog.py add <URL1> <URL2> [--images]
+    python meta_catalog.py maps
+    python meta_catalog.py search "sandstone"
+    python meta_catalog.py build "bollard OR poteau" -o poteaux.apkg --by-map
+    python meta_catalog.py build --map <URL1> --map <URL2> -o fusion.apkg
+
+La syntaxe de recherche est celle de FTS5 : mots (sans accents ni casse),
+"phrase exacte", préfixe*, AND / OR / NOT, rule:mot ou note:mot.
+"""
+
+import sys
+import os
+import argparse
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from learnablemeta_to_anki import (
+    DOWNLOAD_WORKERS, create_anki_package, download_image, iter_metas_from_content,
+)
+
+__all__ = ['Catalog']
+
+# Nombre de lignes insérées par transaction pendant l'enregistrement d'une map
+BATCH_SIZE = 500
+
+_CATALOG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS maps (
+    id integer PRIMARY KEY,
+    url text NOT NULL UNIQUE,
+    title text,
+    generation integer NOT NULL DEFAULT 0,
+    updated_at real
+);
+CREATE TABLE IF NOT EXISTS metas (
+    id integer PRIMARY KEY,
+    map_id integer NOT NULL REFERENCES maps (id),
+    meta_id text NOT NULL,
+    position integer NOT NULL,
+    rule text NOT NULL,
+    note text NOT NULL,
+    image_url text NOT NULL,
+    generation integer NOT NULL,
+    UNIQUE (map_id, meta_id)
+);
+CREATE INDEX IF NOT EXISTS ix_metas_image ON metas (image_url);
+CREATE TABLE IF NOT EXISTS images (
+    url text PRIMARY KEY,
+    sha1 text NOT NULL,
+    size integer NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_images_sha1 ON images (sha1);
+'''
+
+# Index plein texte synchronisé par triggers (table de contenu externe) ;
+# une meta réenregistrée à l'identique n'est pas réindexée
+_FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS metas_fts USING fts5(
+    rule, note, content='metas', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS metas_ai AFTER INSERT ON metas BEGIN
+    INSERT INTO metas_fts (rowid, rule, note) VALUES (new.id, new.rule, new.note);
+END;
+CREATE TRIGGER IF NOT EXISTS metas_ad AFTER DELETE ON metas BEGIN
+    INSERT INTO metas_fts (metas_fts, rowid, rule, note) VALUES ('delete', old.id, old.rule, old.note);
+END;
+CREATE TRIGGER IF NOT EXISTS metas_au AFTER UPDATE OF rule, note ON metas
+WHEN old.rule IS NOT new.rule OR old.note IS NOT new.note BEGIN
+    INSERT INTO metas_fts (metas_fts, rowid, rule, note) VALUES ('delete', old.id, old.rule, old.note);
+    INSERT INTO metas_fts (rowid, rule, note) VALUES (new.id, new.rule, new.note);
+END;
+'''
+
+_UPSERT_META = '''
+INSERT INTO metas (map_id, meta_id, position, rule, note, image_url, generation)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (map_id, meta_id) DO UPDATE SET
+    position = excluded.position, rule = excluded.rule, note = excluded.note,
+    image_url = excluded.image_url, generation = excluded.generation
+'''
+
+_SELECT_METAS = '''
+SELECT metas.meta_id, metas.rule, metas.note, metas.image_url, maps.url, maps.title
+FROM metas JOIN maps ON maps.id = metas.map_id
+'''
+
+_FTS_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+class Catalog:
+    """
+    Catalogue SQLite des metas. Utilisable depuis un autre thread que celui
+    qui l'a ouvert (le pipeline du builder enregistre depuis son producteur).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode = WAL')
+            self._conn.executescript(_CATALOG_SCHEMA)
+            try:
+                self._conn.executescript(_FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                print("⚠️  SQLite sans FTS5 : recherche par LIKE (plus lente)")
+                self.fts = False
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def record_map(self, url, title, metas):
+        """
+        Enregistre les metas d'une map au passage : les metas sont rendues
+        telles quelles, ce qui permet de brancher le catalogue sur le
+        pipeline sans le ralentir. Une fois la map entièrement parcourue,
+        les metas qui n'y figurent plus sont retirées du catalogue.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO maps (url, title, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET title = excluded.title, generation = generation + 1, "
+                "updated_at = excluded.updated_at",
+                (url, title, time.time())
+            )
+            map_id, generation = self._conn.execute(
+                "SELECT id, generation FROM maps WHERE url = ?", (url,)
+            ).fetchone()
+            self._conn.commit()
+
+        batch = []
+        complete = False
+        try:
+            for position, meta in enumerate(metas):
+                batch.append((map_id, str(meta.get('id', position)), position, meta['rule'],
+                              meta['response'], meta['image_url'], generation))
+                if len(batch) >= BATCH_SIZE:
+                    self._write_batch(batch)
+                    batch = []
+                yield meta
+            complete = True
+        finally:
+            with self._lock:
+                if batch:
+                    self._conn.executemany(_UPSERT_META, batch)
+                if complete:
+                    self._conn.execute(
+                        "DELETE FROM metas WHERE map_id = ? AND generation < ?", (map_id, generation)
+                    )
+                self._conn.commit()
+
+    def _write_batch(self, batch):
+        with self._lock:
+            self._conn.executemany(_UPSERT_META, batch)
+            self._conn.commit()
+
+    def add_map(self, url, title, metas):
+        """Enregistre toutes les metas d'une map. Retourne le nombre de metas."""
+        return sum(1 for _ in self.record_map(url, title, metas))
+
+    def maps(self):
+        """Liste des maps : (url, titre, nombre de metas, date de mise à jour)."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT maps.url, maps.title, COUNT(metas.id), maps.updated_at FROM maps "
+                "LEFT JOIN metas ON metas.map_id = maps.id GROUP BY maps.id ORDER BY maps.title"
+            ).fetchall()
+
+    def search(self, query=None, maps=None, limit=None, by_rank=False):
+        """
+        Itère sur les metas correspondant à la recherche plein texte query
+        (toutes si None), éventuellement restreintes aux URLs de maps. Les
+        metas sont des dicts comme ceux du builder, plus 'map_url' et
+        'map_title' ; l'ordre est celui des maps, ou la pertinence avec by_rank.
+        """
+        sql = _SELECT_METAS
+        where = []
+        params = []
+        if query:
+            if self.fts:
+                sql += "JOIN metas_fts ON metas_fts.rowid = metas.id "
+                where.append("metas_fts MATCH ?")
+                params.append(query)
+            else:
+                for term in _FTS_TERM_PATTERN.findall(query):
+                    where.append("(metas.rule LIKE ? OR metas.note LIKE ?)")
+                    params += [f"%{term}%"] * 2
+        if maps:
+            where.append(f"maps.url IN ({', '.join('?' * len(maps))})")
+            params += list(maps)
+        if where:
+            sql += "WHERE " + " AND ".join(where) + " "
+        if by_rank and query and self.fts:
+            sql += "ORDER BY metas_fts.rank"
+        else:
+            sql += "ORDER BY maps.title, maps.id, metas.position"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+
+        with self._lock:
+            try:
+                cursor = self._conn.execute(sql, params)
+            except sqlite3.OperationalError:
+                if not (query and self.fts):
+                    raise
+                # Requête invalide pour FTS5 (ponctuation...) : chercher les mots tels quels
+                params[0] = " ".join(f'"{term}"' for term in _FTS_TERM_PATTERN.findall(query)) or '""'
+                cursor = self._conn.execute(sql, params)
+
+        for meta_id, rule, note, image_url, map_url, map_title in self._fetch(cursor):
+            yield {
+                'id': meta_id,
+                'rule': rule,
+                'response': note,
+                'image_url': image_url,
+                'map_url': map_url,
+                'map_title': map_title,
+            }
+
+    def _fetch(self, cursor):
+        # Lecture par blocs : une requête sur tout le catalogue ne charge pas
+        # tous les résultats en mémoire
+        with self._lock:
+            rows = cursor.fetchmany(BATCH_SIZE)
+        while rows:
+            yield from rows
+            with self._lock:
+                rows = cursor.fetchmany(BATCH_SIZE)
+
+    def index_images(self, media_dir, workers=DOWNLOAD_WORKERS):
+        """
+        Télécharge (dans media_dir, qui sert ensuite de cache aux
+        constructions) et hache les images pas encore connues du catalogue.
+        Retourne le nombre d'images ajoutées.
+        """
+        with self._lock:
+            urls = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT image_url FROM metas WHERE image_url != '' "
+                "AND image_url NOT IN (SELECT url FROM images)"
+            )]
+
+        def hash_image(url):
+            filepath, _ = download_image(url, media_dir)
+            return _hash_image(url, filepath) if filepath else None
+
+        added = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for row in pool.map(hash_image, urls):
+                if row:
+                    with self._lock:
+                        self._conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?)", row)
+                    added += 1
+        with self._lock:
+            self._conn.commit()
+        return added
+
+    def record_image(self, url, filepath):
+        """
+        Enregistre l'empreinte (sha1, taille) d'une image déjà téléchargée,
+        sauf si l'URL est déjà connue. Appelé depuis le pool de
+        téléchargement du builder (--catalog) ; l'écriture est validée avec
+        les metas suivantes ou à la fermeture du catalogue.
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM images WHERE url = ?", (url,)).fetchone():
+                return False
+        row = _hash_image(url, filepath)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?)", row)
+        return True
+
+    def duplicate_images(self):
+        """Images identiques publiées sous plusieurs URLs : (sha1, [urls])."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT sha1, GROUP_CONCAT(url, char(10)) FROM images GROUP BY sha1 HAVING COUNT(*) > 1"
+            ).fetchall()
+        return [(sha1, urls.split('\n')) for sha1, urls in rows]
+
+
+def _hash_image(url, filepath):
+    """Ligne de la table images pour un fichier téléchargé : (url, sha1, taille)."""
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    return url, hashlib.sha1(data).hexdigest(), len(data)
+
+
+def _iter_by_map(metas):
+    """Regroupe des metas triées par map en paires (titre de la map, metas) pour les sous-decks."""
+    current = None
+    section = []
+    for meta in metas:
+        if meta['map_url'] != current and section:
+            yield section[0]['map_title'], section
+            section = []
+        current = meta['map_url']
+        section.append(meta)
+    if section:
+        yield section[0]['map_title'], section
+
+
+def build_from_catalog(catalog, output_path, deck_name, query=None, maps=None, by_map=False,
+                       package_format='legacy', media_cache=None):
+    """
+    Construit un .apkg à partir d'une recherche dans le catalogue. Avec
+    by_map, chaque map devient un sous-deck. Retourne le nombre de metas
+    retenues (aucun fichier n'est créé s'il est nul).
+    """
+    metas = catalog.search(query, maps)
+    first = next(metas, None)
+    if first is None:
+        return 0
+
+    count = 0
+
+    def chained():
+        nonlocal count
+        count = 1
+        yield first
+        for meta in metas:
+            count += 1
+            yield meta
+
+    if by_map:
+        # Une section est gardée en mémoire le temps de la passer au builder
+        create_anki_package(None, deck_name, output_path, subdecks=_iter_by_map(chained()),
+                            package_format=package_format, media_cache=media_cache, catalog=catalog)
+    else:
+        create_anki_package(chained(), deck_name, output_path, package_format=package_format,
+                            media_cache=media_cache, catalog=catalog)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Catalogue local des metas LearnableMeta avec recherche plein texte.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Exemple: python meta_catalog.py search \"sandstone\"",
+    )
+    parser.add_argument('--db', default='meta_catalog.db', help="Fichier du catalogue (défaut: meta_catalog.db)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="Extraire des maps et les enregistrer dans le catalogue")
+    add.add_argument('urls', nargs='+', metavar='url')
+    add.add_argument('--keep-formatting', action='store_true',
+                     help="Conserver le gras, l'italique et les liens des descriptions")
+    add.add_argument('--images', action='store_true',
+                     help="Télécharger et hacher aussi les images (cache des constructions)")
+
+    commands.add_parser('maps', help="Lister les maps du catalogue")
+
+    search = commands.add_parser('search', help="Rechercher des metas (syntaxe FTS5)")
+    search.add_argument('query')
+    search.add_argument('--map', action='append', dest='maps', metavar='URL', help="Restreindre à une map")
+    search.add_argument('--limit', type=int, default=20, help="Nombre de résultats (défaut: 20)")
+
+    build = commands.add_parser('build', help="Construire un .apkg à partir d'une recherche")
+    build.add_argument('query', nargs='?', help="Recherche (toutes les metas si absente)")
+    build.add_argument('--map', action='append', dest='maps', metavar='URL', help="Restreindre à une map")
+    build.add_argument('-o', '--output', required=True, help="Fichier .apkg de sortie")
+    build.add_argument('--deck-name', default="LearnableMeta", help="Nom du deck (défaut: LearnableMeta)")
+    build.add_argument('--by-map', action='store_true', help="Un sous-deck par map")
+    build.add_argument('--format', choices=['legacy', 'modern'], default='legacy',
+                       help="Format du paquet (défaut: legacy)")
+
+    args = parser.parse_args(argv)
+    media_dir = os.path.splitext(args.db)[0] + '_media'
+
+    with Catalog(args.db) as catalog:
+        if args.command == 'add':
+            from learnablemeta_daemon import load_map
+            for url in args.urls:
+                page_content, title = load_map(url)
+                count = catalog.add_map(url, title, iter_metas_from_content(page_content, args.keep_formatting))
+                print(f"📚 {title} : {count} metas enregistrées")
+            if args.images:
+                print(f"🖼️  {catalog.index_images(media_dir)} nouvelles images indexées")
+
+        elif args.command == 'maps':
+            for url, title, count, updated_at in catalog.maps():
+                print(f"  {title} ({count} metas, {time.strftime('%Y-%m-%d %H:%M', time.localtime(updated_at))})")
+                print(f"     {url}")
+
+        elif args.command == 'search':
+            found = 0
+            for meta in catalog.search(args.query, args.maps, args.limit, by_rank=True):
+                found += 1
+                note = meta['response'] if len(meta['response']) <= 120 else meta['response'][:117] + "..."
+                print(f"  [{meta['map_title']}] {meta['rule']}")
+                print(f"     {note}")
+            print(f"\n🔍 {found} résultat(s)")
+
+        elif args.command == 'build':
+            count = build_from_catalog(catalog, args.output, args.deck_name, args.query, args.maps,
+                                       args.by_map, args.format, media_dir)
+            if not count:
+                print("\n❌ Aucune meta ne correspond à la recherche!")
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
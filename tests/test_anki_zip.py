@@ -0,0 +1,81 @@
+"""Écriture parallèle des archives (anki_zip.ParallelZipWriter)."""
+
+import os
+import random
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from anki_zip import CHUNK_SIZE, ParallelZipWriter
+
+
+def payload(size, seed):
+    """Octets moyennement compressibles, différents d'un appel à l'autre."""
+    rng = random.Random(seed)
+    words = [bytes(rng.randrange(97, 123) for _ in range(rng.randrange(3, 9))) for _ in range(500)]
+    data = b' '.join(rng.choice(words) for _ in range(size // 4))
+    return data[:size]
+
+
+@pytest.fixture
+def members(tmp_path):
+    """Membres à écrire : petits, compressés par blocs et stockés par blocs."""
+    big = tmp_path / 'collection.anki2'
+    big.write_bytes(payload(2 * CHUNK_SIZE + 12345, 1))
+    stored = tmp_path / 'collection.anki21b'
+    stored.write_bytes(os.urandom(CHUNK_SIZE + 777))
+    return [
+        ('0', payload(5000, 2), 'image'),
+        ('collection.anki2', big, 'collection'),
+        ('collection.anki21b', stored, 'stored'),
+        ('media', b'{"0": "a.png"}', 'media'),
+        ('1', b'', 'image'),
+    ]
+
+
+def test_round_trip(tmp_path, members):
+    path = str(tmp_path / 'deck.apkg')
+    with ParallelZipWriter(path, workers=4) as zf:
+        for name, source, kind in members:
+            if isinstance(source, bytes):
+                zf.writestr(name, source, kind)
+            else:
+                zf.write(str(source), name, kind)
+        zf.comment = b'empreinte'
+
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [name for name, _, _ in members]
+        assert zf.comment == b'empreinte'
+        for name, source, kind in members:
+            expected = source if isinstance(source, bytes) else source.read_bytes()
+            assert zf.read(name) == expected
+            info = zf.getinfo(name)
+            stored = kind in ('image', 'stored')
+            assert info.compress_type == (zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+
+
+def test_output_does_not_depend_on_workers(tmp_path, members):
+    outputs = []
+    for workers in (1, 4):
+        path = str(tmp_path / f'deck{workers}.apkg')
+        with ParallelZipWriter(path, workers=workers) as zf:
+            for name, source, kind in members:
+                if isinstance(source, bytes):
+                    zf.writestr(name, source, kind)
+                else:
+                    zf.write(str(source), name, kind)
+        with zipfile.ZipFile(path) as zf:
+            outputs.append([(info.filename, info.CRC, info.compress_size) for info in zf.infolist()])
+    assert outputs[0] == outputs[1]
+
+
+def test_exception_removes_archive(tmp_path):
+    path = str(tmp_path / 'deck.apkg')
+    with pytest.raises(RuntimeError):
+        with ParallelZipWriter(path) as zf:
+            zf.writestr('collection.anki2', payload(CHUNK_SIZE, 3), 'collection')
+            raise RuntimeError("interrompu")
+    assert not os.path.exists(path)
@@ -0,0 +1,101 @@
+"""Détection automatique des bordures et incrustations (anki_image_cropper)."""
+
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+PIL = pytest.importorskip('PIL')
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from anki_image_cropper import detect_borders, detect_overlays
+
+WIDTH, HEIGHT = 640, 480
+
+
+def gradient():
+    """Image de test 640x480 : dégradé horizontal et vertical, sans bord net."""
+    x = np.linspace(60, 200, WIDTH)[None, :, None]
+    y = np.linspace(0, 40, HEIGHT)[:, None, None]
+    channels = [x + y, x * 0.8 + y, 255 - x + 0 * y]
+    return np.concatenate(channels, axis=2).clip(0, 255).astype(np.uint8)
+
+
+def noisy_photo():
+    rng = np.random.default_rng(0)
+    return (gradient() + rng.normal(0, 12, (HEIGHT, WIDTH, 3))).clip(0, 255).astype(np.uint8)
+
+
+def with_watermark(pixels, size, color=(0, 0, 0)):
+    """Ajoute « © Google » en bas à droite ; retourne (pixels, boîte du texte)."""
+    img = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=size)
+    left, top, right, bottom = draw.textbbox((0, 0), "© Google", font=font)
+    x, y = WIDTH - (right - left) - 10, HEIGHT - (bottom - top) - 10
+    draw.text((x - left, y - top), "© Google", fill=color, font=font)
+    return np.asarray(img), (x, y, x + right - left, y + bottom - top)
+
+
+def covers(box, target):
+    return box[0] <= target[0] and box[1] <= target[1] and box[2] >= target[2] and box[3] >= target[3]
+
+
+@pytest.mark.parametrize('size', [12, 20, 32, 48])
+def test_watermark_found(size):
+    pixels, text_box = with_watermark(gradient(), size)
+    boxes = detect_overlays(pixels)
+    assert len(boxes) == 1
+    assert covers(boxes[0], text_box)
+
+
+@pytest.mark.parametrize('size', [12, 20])
+def test_white_watermark_on_photo(size):
+    dark = (noisy_photo() * 0.5).astype(np.uint8)
+    pixels, text_box = with_watermark(dark, size, (255, 255, 255))
+    boxes = detect_overlays(pixels)
+    assert len(boxes) == 1
+    assert covers(boxes[0], text_box)
+
+
+def test_no_overlay_on_noise():
+    assert detect_overlays(noisy_photo()) == []
+    rng = np.random.default_rng(1)
+    texture = np.kron(rng.integers(0, 255, (120, 160, 1)), np.ones((4, 4, 3))).astype(np.uint8)
+    assert detect_overlays(texture) == []
+
+
+def test_letterbox_removed():
+    pixels = gradient()
+    pixels[:40] = 0
+    pixels[-40:] = 0
+    assert detect_borders(pixels) == (0, 40, WIDTH, HEIGHT - 40)
+
+
+def test_adjacent_borders_of_different_colors():
+    pixels = gradient()
+    pixels[:30] = 255
+    pixels[:, 600:] = 0
+    assert detect_borders(pixels) == (0, 30, 600, HEIGHT)
+
+
+def test_uniform_sky_is_content():
+    pixels = gradient()
+    pixels[:200] = (135, 180, 230)
+    assert detect_borders(pixels) == (0, 0, WIDTH, HEIGHT)
+
+
+def test_sky_above_skyline_is_content():
+    # Ciel uni sur 60 lignes (sous la limite de taille) bordé par des toits
+    # de hauteurs variées : pas de bord net, ce n'est pas une bordure
+    pixels = gradient()
+    sky = np.arange(HEIGHT)[:, None] < 60 + (np.arange(WIDTH)[None, :] // 40) % 4 * 15
+    pixels[sky] = (135, 180, 230)
+    assert detect_borders(pixels) == (0, 0, WIDTH, HEIGHT)
+
+
+def test_no_border():
+    assert detect_borders(gradient()) == (0, 0, WIDTH, HEIGHT)
+    assert detect_borders(noisy_photo()) == (0, 0, WIDTH, HEIGHT)
@@ -0,0 +1,45 @@
+"""Normalisation du texte des metas (learnablemeta_to_anki.clean_text)."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from learnablemeta_to_anki import clean_text
+
+
+@pytest.mark.parametrize('text', [
+    "« ÉTÉ » est chaud",
+    "É…",
+    "ÉTÉ°",
+    "C’est l’été à Nevşehir",
+])
+def test_correct_french_is_untouched(text):
+    assert clean_text(text) == text
+
+
+def test_no_break_space_before_guillemet_is_kept_as_text():
+    # L'espace insécable est normalisée comme toute espace, mais « É » reste « É »
+    assert clean_text("« ÉTÉ\xa0» est chaud") == "« ÉTÉ » est chaud"
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("l'Ã©tÃ© est chaud", "l'été est chaud"),
+    ("Itâ€™s", "It’s"),
+    ("NevÅŸehir", "Nevşehir"),
+    ("Ã‰TÃ‰", "ÉTÉ"),
+])
+def test_mojibake_repaired(text, expected):
+    assert clean_text(text) == expected
+
+
+def test_mojibake_repaired_next_to_correct_text():
+    # Texte mêlé : la réparation par segment laisse intacts « et » et les accents sains
+    assert clean_text("Ã‰TÃ‰ «\xa0chaud\xa0» déjà") == "ÉTÉ « chaud » déjà"
+
+
+def test_escapes_tags_and_entities():
+    text = r"<b>grès</b> &amp; <i>clair</i>&nbsp;!"
+    assert clean_text(text) == "grès &amp; clair\xa0!"
+    assert clean_text(text, keep_formatting=True) == "<b>grès</b> &amp; <i>clair</i>\xa0!"
@@ -0,0 +1,110 @@
+"""Reconstruction planifiée (learnablemeta_daemon) contre un site local."""
+
+import functools
+import http.server
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+PIL = pytest.importorskip('PIL')
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from learnablemeta_daemon import run_daemon
+from learnablemeta_to_anki import read_package_digest
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def write_map(site, name, title, notes, base, later=0):
+    metas = ','.join(
+        f'{{id:{i},name:"Meta {i}",note:"{note}",images:["{base}/img/{name}{i}.png"],locationsCount:"1"}}'
+        for i, note in enumerate(notes)
+    )
+    path = site / 'maps' / name
+    path.write_text(f'<html><h1>{title}</h1><script>data={{metaList:[{metas}]}}</script></html>',
+                    encoding='utf-8')
+    # Last-Modified est à la seconde : later date nettement une modification
+    mtime = time.time() + later
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def site(tmp_path):
+    """Site LearnableMeta factice servi en HTTP : deux maps de deux metas."""
+    root = tmp_path / 'site'
+    (root / 'maps').mkdir(parents=True)
+    (root / 'img').mkdir()
+    for name in ('aaa', 'bbb'):
+        for i in range(2):
+            Image.new('RGB', (40, 30), (i * 100, 50, 200)).save(root / 'img' / f'{name}{i}.png')
+    handler = functools.partial(QuietHandler, directory=str(root))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    write_map(root, 'aaa', 'Turquie', ['Note 0', 'Note 1'], base)
+    write_map(root, 'bbb', 'Grèce', ['Note 0', 'Note 1'], base)
+    yield root, base
+    server.shutdown()
+    server.server_close()
+
+
+def jobs(state_path):
+    conn = sqlite3.connect(state_path)
+    try:
+        return conn.execute("SELECT url, status FROM jobs ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def built(state_path):
+    conn = sqlite3.connect(state_path)
+    try:
+        return conn.execute("SELECT url, output_path FROM maps ORDER BY url").fetchall()
+    finally:
+        conn.close()
+
+
+def test_rebuilds_only_changed_maps(site, tmp_path):
+    root, base = site
+    maps = [f'{base}/maps/aaa', f'{base}/maps/bbb']
+    output_dir = str(tmp_path / 'decks')
+    state_path = str(tmp_path / 'daemon.db')
+
+    run_daemon(maps, output_dir, state_path, workers=1, once=True)
+    assert jobs(state_path) == [(maps[0], 'done'), (maps[1], 'done')]
+    decks = dict(built(state_path))
+    digests = {url: read_package_digest(path) for url, path in decks.items()}
+    assert all(digests.values())
+
+    write_map(root, 'bbb', 'Grèce', ['Note 0', 'Note modifiée'], base, later=10)
+    run_daemon(maps, output_dir, state_path, workers=1, once=True)
+    assert jobs(state_path)[2:] == [(maps[1], 'done')]
+    assert read_package_digest(decks[maps[0]]) == digests[maps[0]]
+    assert read_package_digest(decks[maps[1]]) not in (None, digests[maps[1]])
+
+
+def test_rebuilds_missing_deck(site, tmp_path):
+    _, base = site
+    maps = [f'{base}/maps/aaa']
+    output_dir = str(tmp_path / 'decks')
+    state_path = str(tmp_path / 'daemon.db')
+
+    run_daemon(maps, output_dir, state_path, workers=1, once=True)
+    (_, deck), = built(state_path)
+    digest = read_package_digest(deck)
+    os.remove(deck)
+
+    # Map inchangée mais deck supprimé : la base d'état ne suffit pas
+    run_daemon(maps, output_dir, state_path, workers=1, once=True)
+    assert jobs(state_path) == [(maps[0], 'done'), (maps[0], 'done')]
+    assert read_package_digest(deck) == digest
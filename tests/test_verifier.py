@@ -0,0 +1,87 @@
+"""Vérification des paquets (anki_verifier) : références des médias."""
+
+import contextlib
+import io
+import json
+import os
+import sqlite3
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from anki_verifier import verify_apkg
+from learnablemeta_to_anki import create_anki_package
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+
+@pytest.fixture
+def deck(tmp_path):
+    """Deck legacy d'une note sans image, à compléter avec with_media."""
+    path = str(tmp_path / 'deck.apkg')
+    metas = [{'id': '1', 'rule': 'Règle', 'response': 'Réponse', 'image_url': ''}]
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_anki_package(metas, 'Deck', path, verify=False)
+    return path
+
+
+def with_media(path, files, field=None, css=None):
+    """Réécrit le deck avec des médias en plus, un champ Question ou du CSS modifiés."""
+    with zipfile.ZipFile(path) as zf:
+        members = {name: zf.read(name) for name in zf.namelist()}
+    db_path = path + '.db'
+    with open(db_path, 'wb') as f:
+        f.write(members['collection.anki2'])
+    conn = sqlite3.connect(db_path)
+    if field is not None:
+        flds = conn.execute('SELECT flds FROM notes').fetchone()[0].split('\x1f')
+        flds[1] = field
+        conn.execute('UPDATE notes SET flds = ?', ('\x1f'.join(flds),))
+    if css is not None:
+        models = json.loads(conn.execute('SELECT models FROM col').fetchone()[0])
+        for model in models.values():
+            model['css'] += css
+        conn.execute('UPDATE col SET models = ?', (json.dumps(models),))
+    conn.commit()
+    conn.close()
+    with open(db_path, 'rb') as f:
+        members['collection.anki2'] = f.read()
+    media = json.loads(members['media'])
+    for name, data in files.items():
+        members[str(len(media))] = data
+        media[str(len(media))] = name
+    members['media'] = json.dumps(media).encode()
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return path
+
+
+def test_clean_deck(deck):
+    assert verify_apkg(deck)['ok']
+
+
+def test_unreferenced_media_is_orphan(deck):
+    report = verify_apkg(with_media(deck, {'extra.png': PNG}))
+    assert report['orphans'] == ['extra.png']
+    assert not report['ok']
+
+
+def test_template_media_are_not_orphans(deck):
+    report = verify_apkg(with_media(deck, {'_font.ttf': b'\x00\x01\x00\x00', 'bg.png': PNG},
+                                    css=".card { background: url('bg.png'); }"))
+    assert report['ok'], report
+
+
+@pytest.mark.parametrize('field', ["<img src='a.png'>", '<img class=q src=a.png>', '<IMG SRC="a.png">'])
+def test_src_quoting(deck, field):
+    report = verify_apkg(with_media(deck, {'a.png': PNG}, field=field))
+    assert report['images'] == 1
+    assert report['ok'], report
+
+
+def test_missing_image(deck):
+    report = verify_apkg(with_media(deck, {}, field='<img src="absent.png">'))
+    assert report['missing'] == ['absent.png']